@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+
+#Step pulse timing benchmark. Runs StepMotor and Arm moves on gpiozero mock pins, records every STEP/DIR
+#edge with perf_counter_ns and compares it with the compiled schedule.
+#Usage: python benchmark.py [-o result.json] [--load none,threads,processes] [--workers 3]
+
+import argparse
+import json
+import multiprocessing
+import platform
+import threading
+import time
+import numpy as np
+from gpiozero import Device
+from gpiozero.pins.mock import MockFactory, MockPin
+
+HISTOGRAM_BINS_US = [-1000, -100, -50, -20, -10, -5, -2, 2, 5, 10, 20, 50, 100, 1000]
+
+#Mock pin that timestamps every output change
+class RecordingPin(MockPin):
+    def _change_state(self, value):
+        changed = MockPin._change_state(self, value)
+        if changed and self._function == 'output':
+            self.factory.edges.append((time.perf_counter_ns(), self, value))
+        return changed
+
+class RecordingFactory(MockFactory):
+    def __init__(self):
+        MockFactory.__init__(self, pin_class=RecordingPin)
+        self.edges = []                                          # (perf_counter_ns, pin, level)
+
+#Wraps a pulse engine so every schedule it runs is kept with its start time and the CPU time it used
+class ScheduleRecorder:
+    def __init__(self, pulseEngine):
+        self.pulseEngine = pulseEngine
+        self.runSchedule = pulseEngine.runSchedule
+        self.runs = []                                           # (start perf_counter_ns, schedule)
+        self.cpu_time = 0.0
+        pulseEngine.runSchedule = self.recordSchedule
+
+    def recordSchedule(self, schedule):
+        cpu_start = time.thread_time()
+        self.runs.append((time.perf_counter_ns(), schedule))
+        self.runSchedule(schedule)
+        self.cpu_time = self.cpu_time + time.thread_time() - cpu_start
+
+    def clear(self):
+        self.runs = []
+        self.cpu_time = 0.0
+
+def busyThread(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+def busyProcess(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+#Synthetic background load: Python threads fight for the GIL, processes for the CPU cores
+class BackgroundLoad:
+    def __init__(self, kind, workers):
+        self.kind = kind
+        self.workers = workers
+        self.stopEvent = None
+        self.tasks = []
+
+    def __enter__(self):
+        if self.kind == 'threads':
+            self.stopEvent = threading.Event()
+            self.tasks = [threading.Thread(target=busyThread, args=(self.stopEvent,), daemon=True) for i in range(self.workers)]
+        elif self.kind == 'processes':
+            self.stopEvent = multiprocessing.Event()
+            self.tasks = [multiprocessing.Process(target=busyProcess, args=(self.stopEvent,), daemon=True) for i in range(self.workers)]
+        for task in self.tasks:
+            task.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.stopEvent is not None:
+            self.stopEvent.set()
+        for task in self.tasks:
+            task.join()
+
+#Pair every recorded STEP rising edge with the schedule tick that produced it
+def matchEdges(edges, runs, pulseEngine):
+    channel_of = {}
+    for channel in range(len(pulseEngine.pins)):
+        channel_of[pulseEngine.pins[channel].pin] = channel
+    actual = [[] for axis in range(pulseEngine.axis_count)]
+    for edge_time, pin, level in edges:
+        channel = channel_of.get(pin)
+        if channel is not None and channel < pulseEngine.axis_count and level:
+            actual[channel].append(edge_time)
+    matched = []                                                 # per run: per axis [(expected ns, actual ns)]
+    used = [0] * pulseEngine.axis_count
+    for start, schedule in runs:
+        pairs = [[] for axis in range(pulseEngine.axis_count)]
+        for tick_time, bits, mask in schedule:
+            for axis in range(pulseEngine.axis_count):
+                if mask >> axis & 1 and bits >> axis & 1 and used[axis] < len(actual[axis]):
+                    pairs[axis].append((start + tick_time * 1000, actual[axis][used[axis]]))
+                    used[axis] = used[axis] + 1
+        matched.append(pairs)
+    return matched
+
+def analyse(name, edges, recorder, wall_time):
+    matched = matchEdges(edges, recorder.runs, recorder.pulseEngine)
+    interval_error = []
+    lateness = []
+    skew = []
+    steps = 0
+    for pairs in matched:
+        by_tick = {}
+        for axis_pairs in pairs:
+            steps = steps + len(axis_pairs)
+            for k in range(len(axis_pairs)):
+                expected, actual = axis_pairs[k]
+                lateness.append(actual - expected)
+                by_tick.setdefault(expected, []).append(actual)
+                if k != 0:
+                    interval_error.append((actual - axis_pairs[k - 1][1]) - (expected - axis_pairs[k - 1][0]))
+        for tick_edges in by_tick.values():
+            if len(tick_edges) > 1:
+                skew.append(max(tick_edges) - min(tick_edges))
+    interval_error = np.array(interval_error, dtype=float) / 1000
+    lateness = np.array(lateness, dtype=float) / 1000
+    skew = np.array(skew, dtype=float) / 1000
+    counts, bins = np.histogram(interval_error, bins=[-np.inf] + HISTOGRAM_BINS_US + [np.inf])
+    histogram = []
+    for i in range(len(counts)):
+        histogram.append({
+            "low_us": None if np.isinf(bins[i]) else float(bins[i]),
+            "high_us": None if np.isinf(bins[i + 1]) else float(bins[i + 1]),
+            "count": int(counts[i]),
+        })
+    return {
+        "scenario": name,
+        "steps": steps,
+        "wall_time_s": wall_time,
+        "step_rate_hz": steps / wall_time if wall_time > 0 else 0.0,
+        "cpu_time_per_step_us": recorder.cpu_time / steps * 1000000 if steps else 0.0,
+        "interval_error_us": summary(interval_error),
+        "interval_error_histogram": histogram,
+        "lateness_us": summary(lateness),
+        "axis_skew_us": summary(skew),
+        "timer": recorder.pulseEngine.timer.report(),
+    }
+
+def summary(values):
+    if len(values) == 0:
+        return {"count": 0}
+    return {
+        "count": int(len(values)),
+        "mean": float(np.mean(values)),
+        "std": float(np.std(values)),
+        "p50": float(np.percentile(values, 50)),
+        "p99": float(np.percentile(values, 99)),
+        "min": float(np.min(values)),
+        "max": float(np.max(values)),
+    }
+
+def constantScenario(arm):
+    arm.armDriver.setProfileMode(0)
+    arm.armDriver.multiMotorRun([1,1,1], [2000,2000,2000], [2000,2000,2000])
+    arm.armDriver.multiMotorRun([0,0,0], [2000,2000,2000], [2000,2000,2000])
+
+def mixedRateScenario(arm):
+    arm.armDriver.setProfileMode(0)
+    arm.armDriver.multiMotorRun([1,1,1], [3000,1500,750], [3000,1500,750])
+    arm.armDriver.multiMotorRun([0,0,0], [3000,1500,750], [3000,1500,750])
+
+def sCurveScenario(arm):
+    arm.armDriver.setProfileMode(2)
+    start = arm.armDriver.lastAngle
+    path = [[start[0] + 20, start[1] + 10, start[2] + 5], [start[0] + 5, start[1] + 20, start[2] - 5], start]
+    arm.armDriver.runSegments(path)
+
+def armLineScenario(arm):
+    arm.armDriver.setProfileMode(0)
+    start = list(arm.last_axis)
+    arm.moveStepMotorToTargetAxis([start[0] + 30, start[1], start[2] - 20], mode=0)
+    arm.moveStepMotorToTargetAxis(start, mode=0)
+
+SCENARIOS = [
+    ("constant_3axis", constantScenario),
+    ("mixed_rates", mixedRateScenario),
+    ("s_curve_path", sCurveScenario),
+    ("arm_line", armLineScenario),
+]
+
+def runBenchmark(loads, workers):
+    factory = RecordingFactory()
+    Device.pin_factory = factory
+    from robotArm import Arm
+    arm = Arm()
+    arm.setFrequency(2000)
+    recorder = ScheduleRecorder(arm.armDriver.pulseEngine)
+    results = []
+    try:
+        for load in loads:
+            for name, scenario in SCENARIOS:
+                with BackgroundLoad(load, workers):
+                    factory.edges = []
+                    recorder.clear()
+                    arm.armDriver.timingReport(reset=True)
+                    start = time.perf_counter()
+                    scenario(arm)
+                    wall_time = time.perf_counter() - start
+                result = analyse(name, factory.edges, recorder, wall_time)
+                result["load"] = load
+                results.append(result)
+                print("%-15s %-9s %7.0f steps/s  interval p99 %7.1f us  skew p99 %7.1f us  cpu %5.1f us/step" % (
+                    name, load, result["step_rate_hz"], result["interval_error_us"].get("p99", 0.0),
+                    result["axis_skew_us"].get("p99", 0.0), result["cpu_time_per_step_us"]))
+    finally:
+        arm.stopMotion()
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Step pulse timing benchmark on mock pins")
+    parser.add_argument("-o", "--output", default="benchmark_%d.json" % int(time.time()))
+    parser.add_argument("--load", default="none,threads,processes", help="comma separated: none, threads, processes")
+    parser.add_argument("--workers", type=int, default=3, help="background load threads or processes")
+    args = parser.parse_args()
+    results = runBenchmark(args.load.split(","), args.workers)
+    report = {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "node": platform.node(),
+        "workers": args.workers,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("saved", args.output)
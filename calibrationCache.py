@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+
+import hashlib
+import json
+import os
+import time
+
+CALIBRATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "calibration.json")
+
+#Read the board serial number, empty when not running on a Raspberry Pi
+def boardSerial():
+    try:
+        with open("/proc/device-tree/serial-number") as f:
+            return f.read().strip("\x00\n ")
+    except OSError:
+        pass
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("Serial"):
+                    return line.split(":")[1].strip()
+    except OSError:
+        pass
+    return ""
+
+#Hash of everything a stored calibration depends on: the board, the driver wiring and the microstep mode
+def hardwareFingerprint(stepMotor):
+    hardware = {
+        "serial": boardSerial(),
+        "en": stepMotor.A4988_EN,
+        "msx": stepMotor.A4988_MSX,
+        "dir": stepMotor.A4988_DIR,
+        "step": stepMotor.A4988_STEP,
+        "sensor": stepMotor.tcrt5000.TCRT5000_PIN,
+        "msx_mode": stepMotor.A4988MsxModeValue,
+        "turn_direction": stepMotor.turn_direction,
+        "zero_angle": stepMotor.zeroAngle,
+    }
+    return hashlib.sha1(json.dumps(hardware, sort_keys=True).encode()).hexdigest()
+
+#Only the measured sensor half widths are stored; offsetAngle is set by the application on every start
+def saveCalibration(pulse_count, fingerprint, path=CALIBRATION_FILE):
+    data = {
+        "timestamp": time.time(),
+        "fingerprint": fingerprint,
+        "half_pulse_count": list(pulse_count),
+    }
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_path, path)
+
+#Return the stored sensor half widths, or None when the file is missing, stale or from other hardware
+def loadCalibration(fingerprint, path=CALIBRATION_FILE, max_age=None):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("fingerprint") != fingerprint:
+        return None
+    if max_age is not None and time.time() - data.get("timestamp", 0) > max_age:
+        return None
+    pulse_count = data.get("half_pulse_count")
+    if not isinstance(pulse_count, list) or len(pulse_count) != 3:
+        return None
+    return pulse_count
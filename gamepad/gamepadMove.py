@@ -84,7 +84,7 @@ def calibrate_arm():
     arm.setArmEnable(0)
 
     arm.setFrequency(1000)
-    arm.setArmToSensorPoint()
+    arm.setArmToSensorPointCached()
     arm.setArmEnable(1)
     arm.setArmEnable(0)
 
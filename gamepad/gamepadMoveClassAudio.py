@@ -56,7 +56,7 @@ class RobotArmController:
         print("\n*** Calibrating robot arm... ***")
         self.arm.setArmEnable(0)
         self.arm.setFrequency(1000)
-        self.arm.setArmToSensorPoint()
+        self.arm.setArmToSensorPointCached()
         self.arm.setArmEnable(1)
         self.arm.setArmEnable(0)
 
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+
+import math
+import re
+import sys
+import time
+
+WORD = re.compile(r'([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))')
+COMMENT = re.compile(r'\(.*?\)|;.*')
+INCH = 25.4
+
+#(letter, value) words of one line, comments removed
+def readWords(line):
+    return [(letter, float(value)) for letter, value in WORD.findall(COMMENT.sub('', line).upper())]
+
+#Parse a job lazily: yields (line number, words) for every line that has any, so a file of any size
+#is read one line at a time
+def readGcode(stream):
+    for number, line in enumerate(stream, 1):
+        words = readWords(line)
+        if len(words) != 0:
+            yield number, words
+
+#G-code subset interpreter on top of Arm: G0 rapid, G1 line, G2/G3 arc in the XY plane (I J or R),
+#G4 dwell (P ms or S s), G20/G21 units, G90/G91 distance mode, F feed, M3/M5 pen down and up.
+#Moves are queued without waiting and the executor queue is bounded to bufferMoves, so parsing stays
+#a few moves ahead of the motors and memory stays constant whatever the job size.
+class GcodeExecutor:
+    def __init__(self, arm, servo=None, servo_index=0, servo_angle=(90, 10), pen_lift=10, bufferMoves=32):
+        self.arm = arm
+        self.servo = servo                                       # M3/M5 drive this servo when given
+        self.servo_index = servo_index
+        self.servo_angle = servo_angle                           # servo angle for M5 (up/open) and M3 (down/closed)
+        self.servo_delay = 0.2                                   # seconds for the servo to settle
+        self.pen_lift = pen_lift                                 # without a servo M5 raises the pen this far (mm)
+        self.bufferMoves = bufferMoves                           # queued moves ahead of the motors
+        self.origin = [0, 0, 0]                                  # arm coordinate of the job zero (mm)
+        self.rapidMode = 4                                       # moveStepMotorToTargetAxis mode of G0
+        self.lineMode = 3                                        # mode of G1 and of the chords of G2/G3
+        self.pulsesPerMm = None                                  # F (mm/min) to pulse frequency, None ignores F
+        self.position = None                                     # job coordinate of the pen
+        self.penUp = None                                        # unknown until M3/M5 or the first move
+        self.absolute = True
+        self.scale = 1                                           # mm per unit
+        self.motion = 0                                          # modal G0/G1/G2/G3
+        self.lineNumber = 0
+
+    def setOrigin(self, origin):
+        self.origin = list(origin)
+
+    #Convert feed to step frequency: pulses of the leading joint per mm of travel
+    def setFeedScale(self, pulsesPerMm):
+        self.pulsesPerMm = pulsesPerMm
+
+    def armPoint(self, point):
+        lift = self.pen_lift if self.penUp and self.servo is None else 0
+        return [point[0] + self.origin[0], point[1] + self.origin[1], point[2] + self.origin[2] + lift]
+
+    def moveTo(self, point, mode):
+        self.arm.moveStepMotorToTargetAxis(self.armPoint(point), mode, wait=False)
+        self.position = list(point)
+
+    #Target of a motion word set: absolute or relative, in the current units, missing axes unchanged
+    def target(self, values):
+        point = list(self.position)
+        for axis, letter in enumerate("XYZ"):
+            if letter in values:
+                value = values[letter] * self.scale
+                point[axis] = point[axis] + value if not self.absolute else value
+        return point
+
+    #Split an XY arc into chords no further than the arm chord tolerance from it; Z moves linearly
+    def arcPoints(self, end, values, clockwise):
+        start = self.position
+        if "R" in values:
+            radius = values["R"] * self.scale
+            dx = end[0] - start[0]
+            dy = end[1] - start[1]
+            chord = math.hypot(dx, dy)
+            if chord == 0 or chord > 2 * math.fabs(radius) + 1e-6:
+                raise ValueError("arc radius %s does not fit the end point" % values["R"])
+            height = math.sqrt(max(radius * radius - chord * chord / 4, 0))
+            #Negative R takes the long way round
+            side = -1 if clockwise == (radius > 0) else 1
+            center = [start[0] + dx / 2 - side * height * dy / chord, start[1] + dy / 2 + side * height * dx / chord]
+            radius = math.fabs(radius)
+        else:
+            center = [start[0] + values.get("I", 0) * self.scale, start[1] + values.get("J", 0) * self.scale]
+            radius = math.hypot(start[0] - center[0], start[1] - center[1])
+        start_angle = math.atan2(start[1] - center[1], start[0] - center[0])
+        end_angle = math.atan2(end[1] - center[1], end[0] - center[0])
+        sweep = end_angle - start_angle
+        if clockwise and sweep >= 0:
+            sweep = sweep - 2 * math.pi
+        elif not clockwise and sweep <= 0:
+            sweep = sweep + 2 * math.pi
+        tolerance = self.arm.chordTolerance
+        if radius <= tolerance:
+            count = 1
+        else:
+            count = max(1, int(math.ceil(math.fabs(sweep) / (2 * math.acos(1 - tolerance / radius)))))
+        for k in range(1, count):
+            angle = start_angle + sweep * k / count
+            yield [center[0] + radius * math.cos(angle), center[1] + radius * math.sin(angle),
+                   start[2] + (end[2] - start[2]) * k / count]
+        yield end
+
+    def setPen(self, up):
+        if up == self.penUp:
+            return
+        if self.servo is not None:
+            executor = self.arm.motionExecutor
+            executor.enqueueAction(self.servo.setServoAngle, self.servo_index, self.servo_angle[0 if up else 1])
+            executor.enqueueAction(time.sleep, self.servo_delay)
+            self.penUp = up
+        else:
+            self.penUp = up
+            self.moveTo(self.position, self.lineMode)
+
+    def setFeed(self, feed):
+        if self.pulsesPerMm is None or feed <= 0:
+            return
+        frequency = max(1, round(feed * self.scale / 60 * self.pulsesPerMm))
+        self.arm.motionExecutor.enqueueAction(self.arm.setFrequency, frequency)
+
+    def execute(self, words):
+        values = {}
+        codes = []
+        for letter, value in words:
+            if letter in "GM":
+                codes.append((letter, value))
+            else:
+                values[letter] = value
+        motion = None
+        dwell = None
+        for letter, value in codes:
+            code = int(value) if value == int(value) else value
+            if letter == "G" and code in (0, 1, 2, 3):
+                motion = code
+            elif letter == "G" and code == 4:
+                dwell = values["P"] / 1000 if "P" in values else values.get("S", 0)
+            elif letter == "G" and code == 20:
+                self.scale = INCH
+            elif letter == "G" and code == 21:
+                self.scale = 1
+            elif letter == "G" and code == 90:
+                self.absolute = True
+            elif letter == "G" and code == 91:
+                self.absolute = False
+            elif letter == "G" and code == 17:
+                pass
+            elif letter == "M" and code in (3, 4):
+                self.setPen(False)
+            elif letter == "M" and code == 5:
+                self.setPen(True)
+            elif letter == "M" and code in (0, 1, 2, 30):
+                pass
+            else:
+                print("gcodeExecutor.py, line %d: unsupported %s%s ignored" % (self.lineNumber, letter, code))
+        if "F" in values:
+            self.setFeed(values["F"])
+        #The dwell runs before the motion of its line, as in RS274
+        if dwell is not None:
+            self.arm.motionExecutor.enqueueAction(time.sleep, dwell)
+        if motion is not None:
+            self.motion = motion
+        elif not any(letter in values for letter in "XYZIJR"):
+            return
+        #A job that never set the pen travels to its start with the pen up and draws with it down
+        if self.penUp is None:
+            self.setPen(self.motion == 0)
+        end = self.target(values)
+        if self.motion in (2, 3):
+            for point in self.arcPoints(end, values, self.motion == 2):
+                self.moveTo(point, self.lineMode)
+        elif end != self.position:
+            self.moveTo(end, self.rapidMode if self.motion == 0 else self.lineMode)
+
+    #Run a job from an open file (or sys.stdin); returns False after printing the first error, whether the
+    #line could not be parsed or a move failed on the motors
+    def run(self, stream):
+        arm = self.arm
+        if self.position is None:
+            self.position = [arm.last_axis[i] - self.origin[i] for i in range(3)]
+        arm.motionExecutor.setCapacity(self.bufferMoves)
+        try:
+            for self.lineNumber, words in readGcode(stream):
+                self.execute(words)
+            arm.waitMotion()
+        except Exception as e:
+            print("gcodeExecutor.py, line %d: %s" % (self.lineNumber, e))
+            self.drain()
+            self.position = None
+            return False
+        finally:
+            arm.motionExecutor.setCapacity(0)
+        return True
+
+    #Let the moves queued before an error finish; a later failure among them was already reported by the
+    #motion executor and is not raised again
+    def drain(self):
+        try:
+            self.arm.waitMotion()
+        except Exception:
+            pass
+
+    def runFile(self, path):
+        if path == "-":
+            return self.run(sys.stdin)
+        with open(path) as f:
+            return self.run(f)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("usage: python gcodeExecutor.py job.gcode|- [mock]")
+        sys.exit(1)
+    if len(sys.argv) == 3 and sys.argv[2] == 'mock':
+        from gpiozero import Device
+        from gpiozero.pins.mock import MockFactory
+        Device.pin_factory = MockFactory()
+    import robotArm
+    arm = robotArm.Arm()
+    arm.setArmEnable(0)
+    try:
+        start = time.perf_counter()
+        done = GcodeExecutor(arm).runFile(sys.argv[1])
+        print("job %s in %.1f s, arm at %s" % ("finished" if done else "stopped", time.perf_counter() - start, arm.last_axis))
+    finally:
+        arm.setArmEnable(1)
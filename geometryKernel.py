@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+
+import numpy as np
+
+SEGMENT_MISSES = 0                                               # the segment stays outside
+SEGMENT_CROSSES = 1                                              # enters and leaves again: entry and exit set
+SEGMENT_ENTERS = 2                                               # ends inside: entry set
+SEGMENT_EXITS = 3                                                # starts inside: exit set
+SEGMENT_INSIDE = 4                                               # lies completely inside
+
+#Intersect N segments with one circle (dims=2, an infinite column along z) or sphere (dims=3).
+#Solves |S + t(E-S) - C|^2 = r^2 for every segment at once; touching counts as missing.
+#Returns the status codes (N,), the entry and exit points (N,3, NaN where there is none) and t of both.
+def segmentIntersections(starts, ends, center, radius, dims):
+    starts = np.asarray(starts, dtype=float).reshape(-1, 3)
+    ends = np.asarray(ends, dtype=float).reshape(-1, 3)
+    d = (ends - starts)[:, :dims]
+    f = starts[:, :dims] - np.asarray(center, dtype=float)[:dims]
+    a = np.einsum('ij,ij->i', d, d)
+    b = 2 * np.einsum('ij,ij->i', f, d)
+    c = np.einsum('ij,ij->i', f, f) - radius * radius
+    discriminant = b * b - 4 * a * c
+    hit = (a > 0) & (discriminant > 0)
+    root = np.sqrt(np.where(hit, discriminant, 0))
+    denominator = np.where(hit, 2 * a, 1)
+    t_entry = np.where(hit, (-b - root) / denominator, np.nan)
+    t_exit = np.where(hit, (-b + root) / denominator, np.nan)
+    status = np.full(len(starts), SEGMENT_MISSES, dtype=np.int8)
+    with np.errstate(invalid='ignore'):
+        enters = hit & (t_entry >= 0) & (t_entry <= 1)
+        exits = hit & (t_exit >= 0) & (t_exit <= 1)
+        status[enters & exits] = SEGMENT_CROSSES
+        status[enters & ~exits] = SEGMENT_ENTERS
+        status[~enters & exits] = SEGMENT_EXITS
+        status[hit & (t_entry < 0) & (t_exit > 1)] = SEGMENT_INSIDE
+    status[(a == 0) & (c < 0)] = SEGMENT_INSIDE                  # no motion across the circle, start inside
+    direction = ends - starts
+    entry = np.where(enters[:, None], starts + t_entry[:, None] * direction, np.nan)
+    exit = np.where(exits[:, None], starts + t_exit[:, None] * direction, np.nan)
+    return status, entry, exit, t_entry, t_exit
+
+#Segments against a vertical column of radius around center (x, y)
+def segmentCircleIntersections(starts, ends, radius, center=(0, 0)):
+    status, entry, exit, t_entry, t_exit = segmentIntersections(starts, ends, center, radius, 2)
+    return status, entry, exit
+
+#Segments against a sphere of radius around center (x, y, z)
+def segmentSphereIntersections(starts, ends, radius, center=(0, 0, 0)):
+    status, entry, exit, t_entry, t_exit = segmentIntersections(starts, ends, center, radius, 3)
+    return status, entry, exit
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+
+from gpiozero import OutputDevice
+import time
+from stepmotor import StepMotor
+from pulseEngine import PulseEngine
+from precisionTimer import DeadlineTimer
+
+#Pulse engine that hands whole pulse trains to the lgpio daemon instead of toggling pins from Python
+class LgpioPulseEngine(PulseEngine):
+    def __init__(self, lgpio, handle, step_gpio, dir_gpio, forward_level=1, wave_size=512):
+        self.lgpio = lgpio
+        self.handle = handle
+        self.step_gpio = step_gpio                                # STEP gpio of motor 1, 2, 3, the first one leads the group
+        self.dir_gpio = dir_gpio                                  # DIR gpio of motor 1, 2, 3, claimed in the same group
+        self.axis_count = len(step_gpio)
+        self.forward_level = forward_level
+        self.direction_level = [0] * self.axis_count
+        self.step_units = 1
+        self.position = [0] * self.axis_count                    # updated once a wave has been sent
+        self.wave_size = wave_size                                # pulses per tx_wave submission
+        self.timer = DeadlineTimer()
+
+    def waitIdle(self, gpio, kind):
+        while self.lgpio.tx_busy(self.handle, gpio, kind) == 1:
+            time.sleep(0.001)
+
+    #Convert [time_us, bits, mask] ticks to lgpio pulses, each delayed until the next tick
+    def scheduleToPulses(self, schedule):
+        pulses = []
+        for i in range(len(schedule)):
+            tick_time, bits, mask = schedule[i]
+            if i + 1 < len(schedule):
+                delay = schedule[i + 1][0] - tick_time
+            else:
+                delay = 0
+            if mask == 0 and len(pulses) != 0:
+                pulses[-1].pulse_delay = pulses[-1].pulse_delay + delay
+            else:
+                pulses.append(self.lgpio.pulse(bits, mask, delay))
+        return pulses
+
+    def runSchedule(self, schedule):
+        pulses = self.scheduleToPulses(schedule)
+        leader = self.step_gpio[0]
+        for i in range(0, len(pulses), self.wave_size):
+            while self.lgpio.tx_room(self.handle, leader, self.lgpio.TX_WAVE) == 0:
+                time.sleep(0.001)
+            self.lgpio.tx_wave(self.handle, leader, pulses[i:i + self.wave_size])
+        self.waitIdle(leader, self.lgpio.TX_WAVE)
+        for tick_time, bits, mask in schedule:
+            self.trackTick(bits, mask)
+
+    #A single axis at a fixed frequency is sent as one tx_pulse train
+    def run(self, intervals):
+        active = [axis for axis in range(self.axis_count) if len(intervals[axis]) != 0]
+        if len(active) == 1:
+            axis_intervals = intervals[active[0]]
+            pulse_period = round(axis_intervals[0])
+            if all(round(interval) == pulse_period for interval in axis_intervals):
+                gpio = self.step_gpio[active[0]]
+                pulse_on = pulse_period // 2
+                self.lgpio.tx_pulse(self.handle, gpio, pulse_on, pulse_period - pulse_on, 0, len(axis_intervals))
+                self.waitIdle(gpio, self.lgpio.TX_PWM)
+                for i in range(len(axis_intervals)):
+                    self.trackTick(1 << active[0], 1 << active[0])
+                return
+        PulseEngine.run(self, intervals)
+
+#Pulse engine that keeps the Python timing loop but writes every tick with a single group_write,
+#so all axes change on the same call instead of one gpiozero call per edge
+class LgpioGroupPulseEngine(PulseEngine):
+    def __init__(self, lgpio, handle, step_gpio, dir_gpio, forward_level=1):
+        PulseEngine.__init__(self, step_gpio, dir_gpio, forward_level)
+        self.lgpio = lgpio
+        self.handle = handle
+        self.leader = step_gpio[0]
+        self.dir_mask = ((1 << self.axis_count) - 1) << self.axis_count
+        self.step_mask = (1 << self.axis_count) - 1
+
+    #Bits follow the group order STEP 1..3, DIR 1..3; DIR changes go out before a rising STEP in the same tick
+    def writeTick(self, bits, mask):
+        if mask & self.dir_mask and bits & mask & self.step_mask:
+            self.lgpio.group_write(self.handle, self.leader, bits, mask & self.dir_mask)
+            self.lgpio.group_write(self.handle, self.leader, bits, mask & self.step_mask)
+        else:
+            self.lgpio.group_write(self.handle, self.leader, bits, mask)
+        self.trackTick(bits, mask)
+
+#StepMotor whose STEP and DIR pins are claimed as one lgpio group; EN and MSx stay on gpiozero.
+#wave=True hands pulse trains to the lgpio daemon, wave=False writes each tick with group_write
+class LgpioStepMotor(StepMotor):
+    def __init__(self, lgpio=None, gpiochip=0, wave=True):
+        if lgpio is None:
+            import lgpio
+        self.lgpio = lgpio
+        self.gpiochip = gpiochip
+        self.wave = wave
+        StepMotor.__init__(self)
+
+    def initA4988(self):
+        self.MODULE_EN = OutputDevice(self.A4988_EN, initial_value=False)
+        self.MODULE_MS1 = OutputDevice(self.A4988_MSX[0], initial_value=False)
+        self.MODULE_MS2 = OutputDevice(self.A4988_MSX[1], initial_value=False)
+        self.MODULE_MS3 = OutputDevice(self.A4988_MSX[2], initial_value=False)
+        self.lgpio_handle = self.lgpio.gpiochip_open(self.gpiochip)
+        self.step_gpio = [self.A4988_STEP[2], self.A4988_STEP[1], self.A4988_STEP[0]]
+        self.dir_gpio = [self.A4988_DIR[2], self.A4988_DIR[1], self.A4988_DIR[0]]
+        self.lgpio.group_claim_output(self.lgpio_handle, self.step_gpio + self.dir_gpio, [0, 0, 0, 0, 0, 0])
+
+    def initPulseEngine(self):
+        if self.wave:
+            self.pulseEngine = LgpioPulseEngine(self.lgpio, self.lgpio_handle, self.step_gpio, self.dir_gpio, self.motorDirection(1))
+        else:
+            self.pulseEngine = LgpioGroupPulseEngine(self.lgpio, self.lgpio_handle, self.step_gpio, self.dir_gpio, self.motorDirection(1))
+
+    def stopA4988(self):
+        self.MODULE_EN.close()
+        self.MODULE_MS1.close()
+        self.MODULE_MS2.close()
+        self.MODULE_MS3.close()
+        self.lgpio.group_free(self.lgpio_handle, self.step_gpio[0])
+        self.lgpio.gpiochip_close(self.lgpio_handle)
+
+    #Set the DIR pins of the motors that are about to move with one group write
+    def setMotorDirection(self, direction, pulse_count):
+        bits = 0
+        mask = 0
+        for i in range(3):
+            if pulse_count[i] != 0:
+                mask |= 1 << (3 + i)
+                bits |= self.motorDirection(direction[i]) << (3 + i)
+                self.pulseEngine.setDirectionLevel(i, self.motorDirection(direction[i]))
+        if mask:
+            self.lgpio.group_write(self.lgpio_handle, self.step_gpio[0], bits, mask)
+
+if __name__ == '__main__':
+    import sys
+    from mockLgpio import MockLgpio
+    if len(sys.argv) == 2 and sys.argv[1] == 'mock':
+        from gpiozero import Device
+        from gpiozero.pins.mock import MockFactory
+        Device.pin_factory = MockFactory()
+        lgpio = MockLgpio()
+    else:
+        lgpio = None
+    for wave in [True, False]:
+        motor = LgpioStepMotor(lgpio, wave=wave)
+        motor.setA4988Enable(0)
+        try:
+            start = time.perf_counter()
+            motor.multiMotorRun([0,0,0], [3200,1600,800], [4000,4000,4000])
+            print("%s: 3200 pulses sent in %.3f s" % ("tx_wave" if wave else "group_write", time.perf_counter() - start))
+        finally:
+            motor.setA4988Enable(1)
+            motor.stopA4988()
+            motor.tcrt5000.stopTCRT5000ALL()
@@ -398,7 +398,7 @@ def play_welcome_and_calibrate():
     arm.setArmEnable(0)
 
     arm.setFrequency(1000)
-    arm.setArmToSensorPoint()
+    arm.setArmToSensorPointCached()
     arm.setArmEnable(1)
     arm.setArmEnable(0)
 
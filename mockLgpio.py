@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+
+import time
+
+#Stand-in for the lgpio module that records every claim, write and submitted waveform
+class MockLgpio:
+    TX_PWM = 0
+    TX_WAVE = 1
+    GROUP_ALL = 0xffffffffffffffff
+
+    class pulse:
+        def __init__(self, group_bits, group_mask, pulse_delay):
+            self.group_bits = group_bits
+            self.group_mask = group_mask
+            self.pulse_delay = pulse_delay
+
+    def __init__(self, simulate_timing=True, wave_queue_size=16):
+        self.simulate_timing = simulate_timing                  # keep tx_busy true for the wave duration
+        self.wave_queue_size = wave_queue_size
+        self.handles = []
+        self.groups = {}                                         # group leader -> list of gpio
+        self.levels = {}                                         # gpio -> level
+        self.writes = []                                         # (perf_counter_ns, leader, bits, mask)
+        self.waves = []                                          # (perf_counter_ns, leader, [(bits, mask, delay)])
+        self.pulse_trains = []                                   # (perf_counter_ns, gpio, on, off, offset, cycles)
+        self.busy_until = {}                                     # gpio -> perf_counter_ns
+
+    def gpiochip_open(self, gpiochip):
+        handle = len(self.handles)
+        self.handles.append(gpiochip)
+        return handle
+
+    def gpiochip_close(self, handle):
+        return 0
+
+    def gpio_claim_output(self, handle, gpio, level=0, lFlags=0):
+        self.groups[gpio] = [gpio]
+        self.levels[gpio] = level
+        return 0
+
+    def group_claim_output(self, handle, gpio, levels=[0], lFlags=0):
+        self.groups[gpio[0]] = list(gpio)
+        for i in range(len(gpio)):
+            self.levels[gpio[i]] = levels[i] if i < len(levels) else 0
+        return 0
+
+    def gpio_free(self, handle, gpio):
+        self.groups.pop(gpio, None)
+        return 0
+
+    def group_free(self, handle, gpio):
+        self.groups.pop(gpio, None)
+        return 0
+
+    def gpio_write(self, handle, gpio, level):
+        self.levels[gpio] = level
+        self.writes.append((time.perf_counter_ns(), gpio, level, 1))
+        return 0
+
+    def group_write(self, handle, gpio, group_bits, group_mask=GROUP_ALL):
+        self.applyBits(gpio, group_bits, group_mask)
+        self.writes.append((time.perf_counter_ns(), gpio, group_bits, group_mask))
+        return 0
+
+    def applyBits(self, leader, bits, mask):
+        members = self.groups.get(leader, [leader])
+        for i in range(len(members)):
+            if mask >> i & 1:
+                self.levels[members[i]] = bits >> i & 1
+
+    def startTransmission(self, gpio, duration_us):
+        now = time.perf_counter_ns()
+        start = max(now, self.busy_until.get(gpio, now))
+        self.busy_until[gpio] = start + round(duration_us * 1000)
+
+    def tx_pulse(self, handle, gpio, pulse_on, pulse_off, pulse_offset=0, pulse_cycles=0):
+        self.pulse_trains.append((time.perf_counter_ns(), gpio, pulse_on, pulse_off, pulse_offset, pulse_cycles))
+        self.startTransmission(gpio, (pulse_on + pulse_off) * pulse_cycles)
+        return self.wave_queue_size - 1
+
+    def tx_wave(self, handle, gpio, pulses):
+        wave = [(p.group_bits, p.group_mask, p.pulse_delay) for p in pulses]
+        self.waves.append((time.perf_counter_ns(), gpio, wave))
+        for bits, mask, delay in wave:
+            self.applyBits(gpio, bits, mask)
+        self.startTransmission(gpio, sum(p.pulse_delay for p in pulses))
+        return self.wave_queue_size - 1
+
+    def tx_busy(self, handle, gpio, kind):
+        if not self.simulate_timing:
+            return 0
+        return 1 if time.perf_counter_ns() < self.busy_until.get(gpio, 0) else 0
+
+    def tx_room(self, handle, gpio, kind):
+        return self.wave_queue_size
+
+    #Rebuild the absolute edge list [(time_us, bits, mask)] of every wave submitted to a group
+    def waveEdges(self, gpio):
+        edges = []
+        time_us = 0
+        for submit_time, leader, wave in self.waves:
+            if leader != gpio:
+                continue
+            for bits, mask, delay in wave:
+                edges.append((time_us, bits, mask))
+                time_us = time_us + delay
+        return edges
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+
+import collections
+import threading
+import realtime
+
+#Long-lived worker that runs queued joint-space moves. Moves already waiting in the queue when a batch
+#is compiled are blended into it, so the motors do not stop between them. Each batch still starts and
+#ends at rest: the arm stops every lookahead segments, and wherever the queue runs dry before the next
+#move arrives
+class MotionExecutor:
+    def __init__(self, stepMotor, lookahead=2000, realtime=False, priority=50, cpu=None):
+        self.stepMotor = stepMotor
+        self.lookahead = lookahead                               # maximum segments compiled into one pulse stream
+        self.realtime = realtime                                 # run the worker under SCHED_FIFO on one CPU
+        self.priority = priority
+        self.cpu = cpu                                           # None picks an isolated CPU when there is one
+        self.realtimeStatus = None
+        self.jitterReport = None
+        self.moves = collections.deque()                         # queued items, None asks the worker to stop
+        self.capacity = 0                                        # maximum queued items, 0 for no bound
+        self.unfinished = 0                                      # items queued or still running
+        self.error = None                                        # first failure not yet reported to the caller
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    #The stop request goes behind the queued moves but never waits for room in a bounded queue
+    def stop(self):
+        if self.thread is None:
+            return
+        with self.condition:
+            self.moves.append(None)
+            self.unfinished = self.unfinished + 1
+            self.condition.notify_all()
+        self.thread.join()
+        self.thread = None
+
+    #Takes effect the next time the worker is started
+    def setRealtime(self, realtime, priority=50, cpu=None):
+        self.realtime = realtime
+        self.priority = priority
+        self.cpu = cpu
+
+    #Switch the worker thread to real-time scheduling and measure the timer jitter around the switch
+    def enterRealtime(self):
+        before = realtime.measureJitter()
+        self.realtimeStatus = realtime.enableRealtime(self.priority, self.cpu)
+        after = realtime.measureJitter()
+        self.jitterReport = {"before": before, "after": after}
+        print("motionExecutor.py, jitter p99 %.1f us -> %.1f us, worst %.1f us -> %.1f us" % (
+            before["p99_us"], after["p99_us"], before["worst_us"], after["worst_us"]))
+
+    #Queue a move given as a list of target angles; returns immediately
+    def enqueueMove(self, targetAngles):
+        if len(targetAngles) != 0:
+            self.put(list(targetAngles))
+
+    #Queue a joint-space rapid move to one target; moves before and after it are not blended into it
+    def enqueueRapid(self, targetAngle):
+        self.put(("rapid", list(targetAngle)))
+
+    #Queue a move through the trajectory cache: entry is the cached compiled move, or a stub holding only
+    #"targets" and "rapid" that is compiled on the fly. A line move is only replayed or compiled when it
+    #runs on its own; with other line moves around it, it is blended into them like any other move
+    def enqueueCompiled(self, entry, cache, key):
+        self.put(("compiled", entry, cache, key))
+
+    #Replay a cached move; compile and cache it instead when it is a stub or the arm is elsewhere
+    def runCompiled(self, entry, cache, key):
+        if entry.get("steps") is not None and self.stepMotor.replayTrajectory(entry):
+            return
+        cache.put(key, self.stepMotor.compileMove(entry["targets"], entry["rapid"] is not None))
+
+    #Queue a call that runs on the worker in order with the moves, once the moves before it have finished
+    def enqueueAction(self, function, *args):
+        self.put(("action", function, args))
+
+    #Add an item, blocking while a bounded queue is full. A failure of an earlier move is raised here
+    #when wait() has not reported it yet
+    def put(self, item):
+        with self.condition:
+            self.raiseError()
+            while self.capacity != 0 and len(self.moves) >= self.capacity:
+                self.condition.wait()
+                self.raiseError()
+            self.moves.append(item)
+            self.unfinished = self.unfinished + 1
+            self.condition.notify_all()
+
+    def get(self, block=True):
+        with self.condition:
+            while block and len(self.moves) == 0:
+                self.condition.wait()
+            if len(self.moves) == 0:
+                return False
+            item = self.moves.popleft()
+            self.condition.notify_all()
+            return item
+
+    def taskDone(self, count=1):
+        with self.condition:
+            self.unfinished = self.unfinished - count
+            self.condition.notify_all()
+
+    #Called with the condition held
+    def raiseError(self):
+        error = self.error
+        if error is not None:
+            self.error = None
+            raise error
+
+    #Bound the number of queued items; enqueueing blocks while the queue is full. 0 removes the bound
+    def setCapacity(self, capacity):
+        with self.condition:
+            self.capacity = capacity
+            self.condition.notify_all()
+
+    #Block until every queued move has been sent to the motors; raises the first move that failed
+    def wait(self):
+        with self.condition:
+            while self.unfinished != 0:
+                self.condition.wait()
+            self.raiseError()
+
+    def isBusy(self):
+        return self.unfinished != 0
+
+    #After a failed move: drop everything queued behind it, since it was planned from a position the
+    #arm never reached, and put the planned ledger back on the steps actually sent
+    def abort(self, error):
+        print("motionExecutor.py, move failed:", error)
+        for i in range(3):
+            self.stepMotor.plannedPosition[i] = self.stepMotor.pulseEngine.position[i]
+        with self.condition:
+            if self.error is None:
+                self.error = error
+            dropped = 0
+            kept = collections.deque()
+            for item in self.moves:
+                if item is None:
+                    kept.append(item)
+                else:
+                    dropped = dropped + 1
+            self.moves = kept
+            self.unfinished = self.unfinished - dropped
+            self.condition.notify_all()
+
+    #Segments of a queued item that can join the running batch, or None when it has to run on its own
+    def blendSegments(self, move, blending):
+        if not isinstance(move, tuple):
+            return move
+        if move[0] == "compiled" and move[1]["rapid"] is None and (blending or self.nextBlends()):
+            return move[1]["targets"]
+        return None
+
+    #Whether the next queued item is a line move that could be blended
+    def nextBlends(self):
+        with self.condition:
+            if len(self.moves) == 0:
+                return False
+            move = self.moves[0]
+            return move is not None and (not isinstance(move, tuple) or (move[0] == "compiled" and move[1]["rapid"] is None))
+
+    def worker(self):
+        if self.realtime:
+            self.enterRealtime()
+        pending = []                                             # segments taken from the queue but not yet run
+        held = None                                              # item that runs on its own once pending has finished
+        taken = 0                                                # queue items represented in pending and held
+        stopping = False
+        while not stopping or len(pending) != 0 or held is not None:
+            if len(pending) == 0 and held is None:
+                move = self.get()
+                if move is None:
+                    self.taskDone()
+                    break
+                segments = self.blendSegments(move, False)
+                if segments is None:
+                    held = move
+                else:
+                    pending.extend(segments)
+                taken = taken + 1
+            while not stopping and held is None and len(pending) < self.lookahead:
+                move = self.get(block=False)
+                if move is False:
+                    break
+                if move is None:
+                    stopping = True
+                    self.taskDone()
+                    continue
+                segments = self.blendSegments(move, True)
+                if segments is None:
+                    held = move
+                else:
+                    pending.extend(segments)
+                taken = taken + 1
+            try:
+                if len(pending) != 0:
+                    batch = pending[:self.lookahead]
+                    pending = pending[self.lookahead:]
+                    self.stepMotor.runSegments(batch)
+                elif held is not None:
+                    move = held
+                    held = None
+                    if move[0] == "rapid":
+                        self.stepMotor.rapidMoveToTargetAngle(move[1])
+                    elif move[0] == "action":
+                        move[1](*move[2])
+                    else:
+                        self.runCompiled(*move[1:])
+            except Exception as e:
+                pending = []
+                held = None
+                self.abort(e)
+            if len(pending) == 0 and held is None:
+                self.taskDone(taken)
+                taken = 0
+        self.running = False
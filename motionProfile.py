@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+
+import math
+from functools import lru_cache
+
+PROFILE_CONSTANT = 0
+PROFILE_TRAPEZOIDAL = 1
+PROFILE_S_CURVE = 2
+
+#Peak velocity and ramp length (pulses) of a symmetric move of pulse_count pulses
+def rampParameter(pulse_count, start_velocity, max_velocity, acceleration, mode):
+    if mode == PROFILE_S_CURVE:
+        # v(t) = v0 + (vp-v0)(1-cos(pi*t/T))/2, peak acceleration = (vp-v0)*pi/(2T)
+        ramp_length = math.pi * (max_velocity ** 2 - start_velocity ** 2) / (4 * acceleration)
+        if 2 * ramp_length > pulse_count:
+            ramp_length = pulse_count / 2
+            max_velocity = math.sqrt(start_velocity ** 2 + 2 * acceleration * pulse_count / math.pi)
+    else:
+        ramp_length = (max_velocity ** 2 - start_velocity ** 2) / (2 * acceleration)
+        if 2 * ramp_length > pulse_count:
+            ramp_length = pulse_count / 2
+            max_velocity = math.sqrt(start_velocity ** 2 + acceleration * pulse_count)
+    return max_velocity, ramp_length
+
+#Time (s) at which the ramp has covered distance pulses
+def rampTime(distance, start_velocity, peak_velocity, acceleration, mode):
+    if distance <= 0:
+        return 0.0
+    if mode == PROFILE_S_CURVE:
+        ramp_time = math.pi * (peak_velocity - start_velocity) / (2 * acceleration)
+        dv = peak_velocity - start_velocity
+        def position(t):
+            return start_velocity * t + dv / 2 * (t - ramp_time / math.pi * math.sin(math.pi * t / ramp_time))
+        low, high = 0.0, ramp_time
+        t = distance / ((start_velocity + peak_velocity) / 2)
+        for i in range(50):
+            if not low <= t <= high:
+                t = (low + high) / 2
+            error = position(t) - distance
+            if math.fabs(error) < 1e-9:
+                break
+            if error > 0:
+                high = t
+            else:
+                low = t
+            velocity = start_velocity + dv * (1 - math.cos(math.pi * t / ramp_time)) / 2
+            if velocity > 0:
+                t = t - error / velocity
+        return t
+    if acceleration == 0:
+        return distance / start_velocity
+    return (-start_velocity + math.sqrt(start_velocity ** 2 + 2 * acceleration * distance)) / acceleration
+
+#Precompute the period (microseconds) of every pulse of a move, memoized per profile parameters
+@lru_cache(maxsize=256)
+def stepIntervals(pulse_count, start_velocity, max_velocity, acceleration, mode=PROFILE_TRAPEZOIDAL):
+    if pulse_count <= 0 or start_velocity <= 0:
+        return ()
+    if mode == PROFILE_CONSTANT or acceleration <= 0 or max_velocity <= start_velocity:
+        return tuple(1000000 / start_velocity for i in range(pulse_count))
+    peak_velocity, ramp_length = rampParameter(pulse_count, start_velocity, max_velocity, acceleration, mode)
+    ramp_time = rampTime(ramp_length, start_velocity, peak_velocity, acceleration, mode)
+    total_time = 2 * ramp_time + (pulse_count - 2 * ramp_length) / peak_velocity
+    step_time = []
+    for k in range(pulse_count + 1):
+        if k <= ramp_length:
+            t = rampTime(k, start_velocity, peak_velocity, acceleration, mode)
+        elif k < pulse_count - ramp_length:
+            t = ramp_time + (k - ramp_length) / peak_velocity
+        else:
+            t = total_time - rampTime(pulse_count - k, start_velocity, peak_velocity, acceleration, mode)
+        step_time.append(t)
+    return tuple((step_time[k + 1] - step_time[k]) * 1000000 for k in range(pulse_count))
+
+#Duration (s) of a move described by stepIntervals
+def moveDuration(pulse_count, start_velocity, max_velocity, acceleration, mode=PROFILE_TRAPEZOIDAL):
+    return sum(stepIntervals(pulse_count, start_velocity, max_velocity, acceleration, mode)) / 1000000
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+
+import time
+from array import array
+
+#Waits for absolute perf_counter_ns deadlines: sleeps through the bulk of the wait and spins only for the
+#last spin seconds, counting every deadline that was already behind or overshot by more than tolerance.
+#Schedules are played with startSchedule/waitTick: a tick later than catchup moves the rest of the
+#schedule back by its lateness, so a stall stretches one interval instead of bursting the overdue ticks.
+class DeadlineTimer:
+    def __init__(self, spin=0.0002, tolerance=0.00005, catchup=None):
+        self.spin_ns = round(spin * 1000000000)
+        self.tolerance_ns = round(tolerance * 1000000000)
+        self.catchup_ns = self.tolerance_ns if catchup is None else round(catchup * 1000000000)
+        self.origin_ns = 0                                       # perf_counter_ns of tick time 0 of the schedule
+        self.tick_late_ns = array('q')                           # lateness of every tick of the last schedule
+        self.resetStats()
+
+    def setSpin(self, spin):
+        self.spin_ns = round(spin * 1000000000)
+
+    def resetStats(self):
+        self.deadlines = 0
+        self.missed = 0
+        self.total_late_ns = 0
+        self.worst_late_ns = 0
+        self.shifts = 0                                          # ticks that moved their schedule back
+        self.shifted_ns = 0
+
+    def now(self):
+        return time.perf_counter_ns()
+
+    def sleepUntil(self, deadline_ns):
+        remaining = deadline_ns - time.perf_counter_ns()
+        if remaining > self.spin_ns:
+            time.sleep((remaining - self.spin_ns) / 1000000000)
+        now = time.perf_counter_ns()
+        while now < deadline_ns:
+            now = time.perf_counter_ns()
+        late = now - deadline_ns
+        self.deadlines = self.deadlines + 1
+        self.total_late_ns = self.total_late_ns + late
+        if late > self.worst_late_ns:
+            self.worst_late_ns = late
+        if late > self.tolerance_ns:
+            self.missed = self.missed + 1
+        return late
+
+    #Lateness allowed before the schedule is moved back; larger values catch up more but squeeze intervals
+    def setCatchup(self, catchup):
+        self.catchup_ns = round(catchup * 1000000000)
+
+    def startSchedule(self):
+        self.origin_ns = time.perf_counter_ns()
+        self.tick_late_ns = array('q')
+
+    #Wait for a tick time_us after the start of the schedule; returns how late it was (ns)
+    def waitTick(self, time_us):
+        late = self.sleepUntil(self.origin_ns + time_us * 1000)
+        self.tick_late_ns.append(late)
+        if late > self.catchup_ns:
+            self.origin_ns = self.origin_ns + late
+            self.shifts = self.shifts + 1
+            self.shifted_ns = self.shifted_ns + late
+        return late
+
+    #Lateness (us) of every tick of the last schedule, in schedule order
+    def tickLateness(self):
+        return [late / 1000 for late in self.tick_late_ns]
+
+    def sleep(self, second):
+        self.sleepUntil(time.perf_counter_ns() + round(second * 1000000000))
+
+    def report(self):
+        return {
+            "deadlines": self.deadlines,
+            "missed": self.missed,
+            "miss_ratio": self.missed / self.deadlines if self.deadlines else 0.0,
+            "mean_late_us": self.total_late_ns / self.deadlines / 1000 if self.deadlines else 0.0,
+            "worst_late_us": self.worst_late_ns / 1000,
+            "shifts": self.shifts,
+            "shifted_us": self.shifted_ns / 1000,
+        }
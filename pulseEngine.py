@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+
+from precisionTimer import DeadlineTimer
+
+#Schedules are lists of [time_us, bits, mask] ticks; bit axis is the STEP pin and bit axis_count+axis the DIR pin
+class PulseEngine:
+    def __init__(self, step_pins, dir_pins, forward_level=1):
+        self.step_pins = step_pins                               # STEP output of motor 1, 2, 3
+        self.dir_pins = dir_pins                                 # DIR output of motor 1, 2, 3
+        self.axis_count = len(step_pins)
+        self.pins = step_pins + dir_pins
+        self.forward_level = forward_level                       # DIR level that counts pulses upwards
+        self.direction_level = [0] * self.axis_count
+        self.step_units = 1                                      # ledger units one pulse moves
+        self.position = [0] * self.axis_count                    # position ledger per axis, signed by DIR
+        self.timer = DeadlineTimer()                             # sleeps between ticks, spins the last slice
+
+    #Record a DIR level written outside of a schedule
+    def setDirectionLevel(self, axis, level):
+        self.direction_level[axis] = level
+
+    #Update the DIR levels and pulse counters for one tick, DIR before STEP
+    def trackTick(self, bits, mask):
+        for axis in range(self.axis_count):
+            if mask >> (self.axis_count + axis) & 1:
+                self.direction_level[axis] = bits >> (self.axis_count + axis) & 1
+        for axis in range(self.axis_count):
+            if mask >> axis & 1 and bits >> axis & 1:
+                if self.direction_level[axis] == self.forward_level:
+                    self.position[axis] = self.position[axis] + self.step_units
+                else:
+                    self.position[axis] = self.position[axis] - self.step_units
+
+    def setPinState(self, pin, state):
+        if state == 1:
+            pin.on()
+        elif state == 0:
+            pin.off()
+
+    #Period (microseconds) of every pulse of a fixed frequency pulse train
+    def constantIntervals(self, pulse_count, pulse_frequency):
+        if pulse_count == 0 or pulse_frequency == 0:
+            return ()
+        return (1000000 / pulse_frequency,) * pulse_count
+
+    #Build the rising and falling edge times (microseconds) of one axis from its pulse periods
+    def axisEdges(self, intervals):
+        edges = []
+        if len(intervals) == 0:
+            return edges
+        rise_time = 0
+        for pulse_period in intervals:
+            edges.append((round(rise_time), 1))
+            edges.append((round(rise_time + pulse_period / 2), 0))
+            rise_time = rise_time + pulse_period
+        edges.append((round(rise_time), None))                   # trailing low half period
+        return edges
+
+    #Merge the edges of every axis into one time-ordered schedule of [time_us, bits, mask] ticks
+    def buildSchedule(self, intervals):
+        ticks = {}
+        for axis in range(self.axis_count):
+            for edge_time, level in self.axisEdges(intervals[axis]):
+                tick = ticks.setdefault(edge_time, [edge_time, 0, 0])
+                if level is None:
+                    continue
+                tick[2] |= 1 << axis
+                if level == 1:
+                    tick[1] |= 1 << axis
+                else:
+                    tick[1] &= ~(1 << axis)
+        return [ticks[edge_time] for edge_time in sorted(ticks)]
+
+    def addEdge(self, ticks, edge_time, channel, level):
+        edge_time = round(edge_time)
+        tick = ticks.setdefault(edge_time, [edge_time, 0, 0])
+        tick[2] |= 1 << channel
+        if level == 1:
+            tick[1] |= 1 << channel
+        else:
+            tick[1] &= ~(1 << channel)
+
+    #Compile consecutive segments into one continuous schedule without stopping between them.
+    #segments is a list of (direction levels, pulse counts); step_times holds the start time (us) of every
+    #lead pulse plus the end time. Each axis spreads its pulses evenly over the lead pulses of the segment
+    #(pulse j on lead pulse (j + 1/2) * lead / count), so all joints start and finish the segment together.
+    def buildPathSchedule(self, segments, step_times, direction_level):
+        ticks = {}
+        direction_level = list(direction_level)
+        lead = 0
+        for levels, pulse_count in segments:
+            lead_count = max(pulse_count)
+            for axis in range(self.axis_count):
+                if pulse_count[axis] == 0:
+                    continue
+                if levels[axis] != direction_level[axis]:
+                    if lead == 0:
+                        dir_time = step_times[0]
+                    else:
+                        dir_time = step_times[lead] - (step_times[lead] - step_times[lead - 1]) / 4
+                    self.addEdge(ticks, dir_time, self.axis_count + axis, levels[axis])
+                    direction_level[axis] = levels[axis]
+                for j in range(pulse_count[axis]):
+                    k = lead + (2 * j + 1) * lead_count // (2 * pulse_count[axis])
+                    self.addEdge(ticks, step_times[k], axis, 1)
+                    self.addEdge(ticks, (step_times[k] + step_times[k + 1]) / 2, axis, 0)
+            lead = lead + lead_count
+        end_time = round(step_times[lead])
+        ticks.setdefault(end_time, [end_time, 0, 0])
+        return [ticks[edge_time] for edge_time in sorted(ticks)]
+
+    #Write the pins of every channel selected by mask, DIR before STEP
+    def writeTick(self, bits, mask):
+        for channel in range(len(self.pins) - 1, -1, -1):
+            if mask >> channel & 1:
+                self.setPinState(self.pins[channel], bits >> channel & 1)
+        self.trackTick(bits, mask)
+
+    #Drive a schedule from a single timing loop. Ticks are absolute deadlines from the start, but one
+    #late by more than the timer catch-up moves the rest back, so a stall never squeezes the next pulses
+    def runSchedule(self, schedule):
+        self.timer.startSchedule()
+        for tick_time, bits, mask in schedule:
+            self.timer.waitTick(tick_time)
+            if mask:
+                self.writeTick(bits, mask)
+
+    def run(self, intervals):
+        schedule = self.buildSchedule(intervals)
+        if schedule:
+            self.runSchedule(schedule)
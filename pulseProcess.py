@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+
+import multiprocessing
+import struct
+import time
+from multiprocessing import shared_memory
+import numpy as np
+from gpiozero import Device, OutputDevice
+from stepmotor import StepMotor
+from pulseEngine import PulseEngine
+
+RECORD = struct.Struct('<iII')                                   # time_us, bits, mask
+RECORD_DTYPE = np.dtype([('time', '<i4'), ('bits', '<u4'), ('mask', '<u4')])
+BATCH_START = -1                                                 # bits: batch number, mask: ledger units per pulse
+BATCH_END = -2                                                   # bits: batch number
+
+HEAD = 0                                                         # records written by the parent
+TAIL = 1                                                         # records consumed by the pulse process
+COMPLETED = 2                                                    # last batch the pulse process finished
+STOP = 3
+MISSED = 4                                                       # deadlines the pulse process missed
+DEADLINES = 5
+READY = 6                                                        # last batch the pulse process may start playing
+HEADER_WORDS = 8
+
+#Single-producer single-consumer ring of tick records in shared memory. Each side only writes its own
+#index and both are 32 bit words, so no lock is needed. The position ledger lives behind the header: the
+#pulse process writes it while it plays a batch, the parent only between batches (StepMotor.lastAngle).
+class CommandRing:
+    def __init__(self, axis_count, capacity=65536, shm=None):
+        self.axis_count = axis_count
+        self.capacity = capacity                                 # power of two, in records
+        self.records_offset = (HEADER_WORDS + axis_count) * 4
+        if shm is None:
+            shm = shared_memory.SharedMemory(create=True, size=self.records_offset + capacity * RECORD.size)
+            shm.buf[:self.records_offset] = bytes(self.records_offset)
+        self.shm = shm
+        self.views = [shm.buf[:HEADER_WORDS * 4], shm.buf[HEADER_WORDS * 4:self.records_offset]]
+        self.header = self.views[0].cast('I')
+        self.position = self.views[1].cast('i')
+        self.records = np.ndarray((capacity,), dtype=RECORD_DTYPE, buffer=shm.buf, offset=self.records_offset)
+
+    def pending(self):
+        return (self.header[HEAD] - self.header[TAIL]) & 0xffffffff
+
+    #Copy a packed batch into the ring in as few slice copies as the wrap-around allows, publishing HEAD
+    #once per copy. READY is set to batch once the batch is complete, or earlier if the ring fills up.
+    #alive tells whether the pulse process still runs; a full ring with nobody draining it raises
+    def pushBatch(self, records, batch, alive):
+        done = 0
+        while done < len(records):
+            free = self.capacity - self.pending()
+            if free == 0:
+                self.header[READY] = batch
+                if not alive():
+                    raise RuntimeError("pulseProcess.py, pulse process stopped")
+                time.sleep(0.0005)
+                continue
+            head = self.header[HEAD]
+            start = head & (self.capacity - 1)
+            count = min(free, len(records) - done, self.capacity - start)
+            self.records[start:start + count] = records[done:done + count]
+            self.header[HEAD] = (head + count) & 0xffffffff
+            done = done + count
+        self.header[READY] = batch
+
+    def pop(self):
+        tail = self.header[TAIL]
+        if tail == self.header[HEAD]:
+            return None
+        record = RECORD.unpack_from(self.shm.buf, self.records_offset + (tail & (self.capacity - 1)) * RECORD.size)
+        self.header[TAIL] = (tail + 1) & 0xffffffff
+        return record
+
+    def release(self):
+        self.records = None
+        self.header.release()
+        self.position.release()
+        for view in self.views:
+            view.release()
+
+    def close(self):
+        self.release()
+        self.shm.close()
+
+#Body of the pulse process: owns the STEP/DIR pins and plays back every batch pushed into the ring.
+#A batch only starts once the parent has marked it ready, so a stall in the parent cannot starve it
+def pulseWorker(shm, axis_count, capacity, step_gpio, dir_gpio, forward_level, pin_factory):
+    if pin_factory is not None:
+        Device.pin_factory = pin_factory()
+    ring = CommandRing(axis_count, capacity, shm)
+    step_pins = [OutputDevice(gpio, initial_value=False) for gpio in step_gpio]
+    dir_pins = [OutputDevice(gpio, initial_value=False) for gpio in dir_gpio]
+    engine = PulseEngine(step_pins, dir_pins, forward_level)
+    engine.position = ring.position                              # every step is published as it happens
+    timer = engine.timer
+    try:
+        while ring.header[STOP] == 0:
+            record = ring.pop()
+            if record is None:
+                time.sleep(0.0002)
+                continue
+            tick_time, bits, mask = record
+            if tick_time == BATCH_START:
+                engine.step_units = mask
+                while ring.header[READY] != bits and ring.header[STOP] == 0:
+                    time.sleep(0.0002)
+                timer.startSchedule()
+            elif tick_time == BATCH_END:
+                ring.header[MISSED] = timer.missed & 0xffffffff
+                ring.header[DEADLINES] = timer.deadlines & 0xffffffff
+                ring.header[COMPLETED] = bits
+            else:
+                timer.waitTick(tick_time)
+                if mask:
+                    engine.writeTick(bits, mask)
+    finally:
+        for pin in step_pins + dir_pins:
+            pin.close()
+        ring.release()                                           # the mapping itself goes with the process
+
+#Pulse engine that compiles schedules in this process and runs them in a separate one, so a long GIL
+#hold by speech recognition or file I/O cannot stall the step pulses. The pulse process is spawned, not
+#forked, so it does not inherit the pins, sensor callbacks and threads of this one; it builds its own pin
+#factory of the same class.
+class ProcessPulseEngine(PulseEngine):
+    def __init__(self, step_gpio, dir_gpio, forward_level=1, capacity=65536):
+        PulseEngine.__init__(self, step_gpio, dir_gpio, forward_level)
+        self.ring = CommandRing(self.axis_count, capacity)
+        self.position = self.ring.position                       # live ledger published by the pulse process
+        self.batch = 0
+        self.direction_bits = 0                                  # DIR levels to write before the next schedule
+        self.direction_mask = 0
+        pin_factory = type(Device.pin_factory) if Device.pin_factory is not None else None
+        self.process = multiprocessing.get_context('spawn').Process(target=pulseWorker, daemon=True,
+            args=(self.ring.shm, self.axis_count, capacity, step_gpio, dir_gpio, forward_level, pin_factory))
+        self.process.start()
+
+    def setDirectionLevel(self, axis, level):
+        self.direction_level[axis] = level
+        channel = self.axis_count + axis
+        self.direction_mask |= 1 << channel
+        if level == 1:
+            self.direction_bits |= 1 << channel
+        else:
+            self.direction_bits &= ~(1 << channel)
+
+    #Pack one schedule, copy it into the ring and block until the pulse process has played it
+    def runSchedule(self, schedule):
+        self.batch = (self.batch + 1) & 0xffffffff
+        ticks = np.array(schedule, dtype=np.int64).reshape(-1, 3)
+        first = 2 if self.direction_mask else 1
+        records = np.zeros(len(ticks) + first + 1, dtype=RECORD_DTYPE)
+        records[0] = (BATCH_START, self.batch, self.step_units)
+        if self.direction_mask:
+            records[1] = (0, self.direction_bits, self.direction_mask)
+            self.direction_bits = 0
+            self.direction_mask = 0
+        records['time'][first:-1] = ticks[:,0]
+        records['bits'][first:-1] = ticks[:,1]
+        records['mask'][first:-1] = ticks[:,2]
+        records[-1] = (BATCH_END, self.batch, 0)
+        for axis in range(self.axis_count):
+            channel = self.axis_count + axis
+            changes = np.nonzero(ticks[:,2] >> channel & 1)[0]
+            if len(changes) != 0:
+                self.direction_level[axis] = int(ticks[changes[-1], 1] >> channel & 1)
+        self.ring.pushBatch(records, self.batch, self.process.is_alive)
+        while self.ring.header[COMPLETED] != self.batch:
+            if not self.process.is_alive():
+                raise RuntimeError("pulseProcess.py, pulse process stopped")
+            time.sleep(0.0005)
+
+    #Deadline statistics of the pulse process after its last batch
+    def timingReport(self):
+        deadlines = self.ring.header[DEADLINES]
+        missed = self.ring.header[MISSED]
+        return {"deadlines": deadlines, "missed": missed, "miss_ratio": missed / deadlines if deadlines else 0.0}
+
+    def close(self):
+        self.ring.header[STOP] = 1
+        self.process.join()
+        self.position = list(self.position)
+        self.ring.close()
+        self.ring.shm.unlink()
+
+#StepMotor whose STEP and DIR pins are driven from a dedicated process; EN and MSx stay here
+class ProcessStepMotor(StepMotor):
+    def initA4988(self):
+        self.MODULE_EN = OutputDevice(self.A4988_EN, initial_value=False)
+        self.MODULE_MS1 = OutputDevice(self.A4988_MSX[0], initial_value=False)
+        self.MODULE_MS2 = OutputDevice(self.A4988_MSX[1], initial_value=False)
+        self.MODULE_MS3 = OutputDevice(self.A4988_MSX[2], initial_value=False)
+
+    def initPulseEngine(self):
+        self.pulseEngine = ProcessPulseEngine([self.A4988_STEP[2], self.A4988_STEP[1], self.A4988_STEP[0]],
+                                              [self.A4988_DIR[2], self.A4988_DIR[1], self.A4988_DIR[0]],
+                                              self.motorDirection(1))
+
+    def stopA4988(self):
+        self.MODULE_EN.close()
+        self.MODULE_MS1.close()
+        self.MODULE_MS2.close()
+        self.MODULE_MS3.close()
+        self.pulseEngine.close()
+
+    #DIR levels are sent to the pulse process at the start of the next schedule
+    def setMotorDirection(self, direction, pulse_count):
+        for i in range(3):
+            if pulse_count[i] != 0:
+                self.pulseEngine.setDirectionLevel(i, self.motorDirection(direction[i]))
+
+    def timingReport(self, reset=False):
+        return self.pulseEngine.timingReport()
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) == 2 and sys.argv[1] == 'mock':
+        from gpiozero.pins.mock import MockFactory
+        Device.pin_factory = MockFactory()
+    motor = ProcessStepMotor()
+    motor.setA4988Enable(0)
+    try:
+        start = time.perf_counter()
+        motor.multiMotorRun([0,0,0], [3200,1600,800], [4000,4000,4000])
+        print("3200 pulses in %.3f s, position %s" % (time.perf_counter() - start, list(motor.pulseEngine.position)))
+        print(motor.timingReport())
+    finally:
+        motor.setA4988Enable(1)
+        motor.stopA4988()
+        motor.tcrt5000.stopTCRT5000ALL()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+
+import hashlib
+import json
+import os
+import numpy as np
+
+ENVELOPE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+#Table of the reachable radius range at every whole millimetre of height, built with one batch IK call
+#from the joint limits and saved per arm geometry. Reachability only depends on the distance from the
+#base axis and the height, so the same range holds for y at x = 0 and for the radius in any direction.
+class ReachEnvelope:
+    def __init__(self, arm, z_range=(-100, 400), directory=ENVELOPE_DIR):
+        self.arm = arm
+        self.z_range = z_range
+        self.directory = directory
+        self.key = None                                          # geometry the table was built for
+        self.table = None                                        # (heights, 2) min and max radius
+
+    def geometryKey(self):
+        arm = self.arm
+        geometry = [arm.CLAMP_LENGTH, arm.ORIGINAL_HEIGHT, arm.GROUND_HEIGHT, arm.PEN_HEIGHT, arm.L1_LENGTH,
+                    arm.L2_LENGTH, arm.arm_limit_angle1, arm.arm_limit_angle2, arm.arm_limit_angle3, list(self.z_range)]
+        return hashlib.sha1(json.dumps(geometry).encode()).hexdigest()[:16]
+
+    def tablePath(self, key):
+        return os.path.join(self.directory, "reach_envelope_%s.npy" % key)
+
+    #Drop the table in memory; the next query reloads or rebuilds it for the current geometry
+    def invalidate(self):
+        self.key = None
+        self.table = None
+
+    #Same scan as Arm.scan_y_value for every height at once: the minimum is one above the first radius
+    #below 150 that breaks a joint limit, the maximum one below the first one above it; unreachable
+    #radii are skipped and the defaults 80 and 220 kept when nothing breaks a limit
+    def build(self):
+        arm = self.arm
+        heights = np.arange(self.z_range[0], self.z_range[1] + 1)
+        radii = np.arange(1, 400)
+        z, y = np.meshgrid(heights, radii, indexing='ij')
+        points = np.stack([np.zeros(z.size), y.ravel(), z.ravel()], axis=1)
+        angle, valid = arm.solveAngleBatch(points)
+        angleA = 180 - angle[:,1] - angle[:,2]
+        with np.errstate(invalid='ignore'):
+            inside = ((arm.arm_limit_angle1[0] < angleA) & (angleA < arm.arm_limit_angle1[1]) &
+                      (arm.arm_limit_angle2[0] < angle[:,1]) & (angle[:,1] < arm.arm_limit_angle2[1]) &
+                      (arm.arm_limit_angle3[0] < angle[:,2]) & (angle[:,2] < arm.arm_limit_angle3[1]))
+        breaks = (valid & ~inside).reshape(z.shape)
+        table = np.zeros((len(heights), 2))
+        for row in range(len(heights)):
+            below = np.nonzero(breaks[row, 149::-1])[0]          # radius 150 down to 1
+            table[row, 0] = 150 - below[0] + 1 if len(below) != 0 else 80
+            start = int(table[row, 0]) if table[row, 0] > 100 else 100
+            above = np.nonzero(breaks[row, start - 1:])[0]      # radius start up to 399
+            table[row, 1] = start + above[0] - 1 if len(above) != 0 else 220
+        return table
+
+    #Load or build the table once; geometry changes go through invalidate(), so a query never rehashes
+    #the settings
+    def load(self):
+        if self.table is not None:
+            return
+        key = self.geometryKey()
+        path = self.tablePath(key)
+        try:
+            self.table = np.load(path)
+        except (OSError, ValueError):
+            self.table = self.build()
+            try:
+                temp_path = path + ".tmp"
+                with open(temp_path, "wb") as f:
+                    np.save(f, self.table)
+                os.replace(temp_path, path)
+            except OSError as e:
+                print("reachEnvelope.py, table kept in memory only:", e)
+        self.key = key
+
+    #[min, max] reachable radius at height z; None outside the table. Between whole millimetres the range
+    #is the one valid at both neighbouring heights, since the rows are whole-millimetre scans and the
+    #defaults 80 and 220 cannot be interpolated
+    def radiusRange(self, z):
+        self.load()
+        position = z - self.z_range[0]
+        if position < 0 or position > len(self.table) - 1:
+            return None
+        low = self.table[int(np.floor(position))]
+        high = self.table[int(np.ceil(position))]
+        return [float(max(low[0], high[0])), float(min(low[1], high[1]))]
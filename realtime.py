@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+
+import ctypes
+import ctypes.util
+import gc
+import os
+from precisionTimer import DeadlineTimer
+
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+#CPUs listed in isolcpus= on the kernel command line
+def isolatedCpus():
+    try:
+        with open("/sys/devices/system/cpu/isolated") as f:
+            text = f.read().strip()
+    except OSError:
+        return []
+    cpus = []
+    for part in text.split(","):
+        if part == "":
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+#Use the requested CPU, else the last isolated one, else the last one this process may run on
+def chooseCpu(cpu=None):
+    if cpu is not None:
+        return cpu
+    isolated = isolatedCpus()
+    if len(isolated) != 0:
+        return isolated[-1]
+    try:
+        return max(os.sched_getaffinity(0))
+    except AttributeError:
+        return None
+
+def lockMemory():
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+#Move the calling thread to SCHED_FIFO on one CPU and lock the process memory. Every capability is
+#tried on its own; the result maps each one to "ok" or the reason it was skipped
+def enableRealtime(priority=50, cpu=None, lock_memory=True):
+    status = {}
+    cpu = chooseCpu(cpu)
+    try:
+        os.sched_setaffinity(0, [cpu])
+        status["affinity"] = "ok"
+    except (AttributeError, TypeError, OSError) as e:
+        status["affinity"] = str(e)
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        status["sched_fifo"] = "ok"
+    except (AttributeError, OSError) as e:
+        status["sched_fifo"] = str(e)
+    if lock_memory:
+        try:
+            lockMemory()
+            status["mlockall"] = "ok"
+        except (AttributeError, TypeError, OSError) as e:
+            status["mlockall"] = str(e)
+    #Objects alive now are never scanned again, so collections during a move stay short
+    gc.collect()
+    gc.freeze()
+    status["gc_freeze"] = "ok"
+    for capability in status:
+        if status[capability] != "ok":
+            print("realtime.py, %s not available: %s" % (capability, status[capability]))
+    return status
+
+#Wake up count times at a fixed period and report how late the calling thread was
+def measureJitter(period=0.001, count=500):
+    timer = DeadlineTimer()
+    period_ns = round(period * 1000000000)
+    lateness = []
+    start = timer.now()
+    for i in range(1, count + 1):
+        lateness.append(timer.sleepUntil(start + i * period_ns))
+    lateness.sort()
+    return {
+        "mean_us": sum(lateness) / count / 1000,
+        "p99_us": lateness[int(0.99 * (count - 1))] / 1000,
+        "worst_us": lateness[-1] / 1000,
+        "missed": timer.missed,
+    }
+
+if __name__ == '__main__':
+    print("before", measureJitter())
+    print("status", enableRealtime())
+    print("after", measureJitter())
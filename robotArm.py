@@ -1,11 +1,19 @@
 # -*- coding: utf-8 -*-
 #!/usr/bin/env python
 
-from stepmotor import StepMotor
+from stepmotor import StepMotor, MICROSTEP_ANGLE
+from motionExecutor import MotionExecutor
+from reachEnvelope import ReachEnvelope
+import calibrationCache
+import geometryKernel
+import hashlib
+import json
 import math
+import numpy as np
 
 class Arm:
-    def __init__(self):
+    #processPulses runs the step pulses in a separate process, isolated from the GIL of this one
+    def __init__(self, processPulses=False):
         self.CLAMP_LENGTH = 0                                                                      
         self.CLAMP_HEIGHT = 0                                                
         self.ORIGINAL_HEIGHT = 90                                            
@@ -14,7 +22,11 @@ class Arm:
         self.L1_LENGTH = 150                                                 
         self.L2_LENGTH = 150                                                
         self.pi = 3.14159265                                                 
-        self.armDriver = StepMotor()                                         
+        if processPulses:
+            from pulseProcess import ProcessStepMotor
+            self.armDriver = ProcessStepMotor()
+        else:
+            self.armDriver = StepMotor()
         self.last_axis = self.angleToCoordinata(self.armDriver.zeroAngle)
         self.currentAngle = self.armDriver.lastAngle.copy()                
         self.armFrequency = 1000                                            
@@ -34,6 +46,13 @@ class Arm:
         self.arm_limit_angle1 = [26, 150]
         self.arm_limit_angle2 = [0, 110]
         self.arm_limit_angle3 = [-12, 110]
+        self.chordTolerance = 0.1
+        self.reachEnvelope = ReachEnvelope(self)                             # reachable radius per height, built on first use
+        self.base_radius = 60                                                # exclusion sphere around the shoulder axis (mm)
+        self.workspaceField = None                                           # optional path check before a move is queued
+        self.trajectoryCache = None                                          # optional store of compiled moves
+        self.motionExecutor = MotionExecutor(self.armDriver)
+        self.motionExecutor.start()
     #mapping function
     def map(self, value, fromLow, fromHigh, toLow, toHigh):
         return ((toHigh-toLow)*(value-fromLow) / (fromHigh-fromLow) + toLow)
@@ -46,6 +65,18 @@ class Arm:
         return value
     #Calculate the maximum drawing radius of the robotic arm
     def calculate_y_value(self, z):
+        y_value = self.reachEnvelope.radiusRange(z)
+        if y_value is None:
+            return self.scan_y_value(z)
+        return y_value
+    #Reachable |x| range at (y, z): the radius range of that height cut at y; None when y is out of reach
+    def calculate_x_value(self, y, z):
+        radius = self.calculate_y_value(z)
+        if math.fabs(y) > radius[1]:
+            return None
+        return [math.sqrt(max(radius[0]**2 - y**2, 0)), math.sqrt(radius[1]**2 - y**2)]
+    #Scan the drawing radius at height z point by point
+    def scan_y_value(self, z):
         y_value = [80,220]
         for y in range(50,200,1):
             try:
@@ -117,7 +148,7 @@ class Arm:
     def calculate_z_coordinate(self, start_axis, end_axis, axis):
         if start_axis[0] == end_axis[0]:
             if start_axis[1] == end_axis[1]:
-                return "Error Result"
+                return None
             else:
                 t = (axis[1] - start_axis[1]) / (end_axis[1] - start_axis[1])
         elif start_axis[1] == end_axis[1]:
@@ -130,7 +161,7 @@ class Arm:
     def solve_quadratic(self, a, b, c):
         discriminant = b ** 2 - 4 * a * c
         if discriminant <= 0:
-            return "Error Result"
+            return None
         root1 = (-b + math.sqrt(discriminant)) / (2 * a)
         root2 = (-b - math.sqrt(discriminant)) / (2 * a)
         return root1, root2
@@ -157,7 +188,7 @@ class Arm:
             b_value = start_axis[1] - (k_value * start_axis[0])
             r_value = radius
             x_axis = self.find_intersections(k_value, b_value, r_value)
-            if x_axis != "Error Result":                                          
+            if x_axis is not None:                                          
                 y1 = k_value * x_axis[0] + b_value                                
                 y2 = k_value * x_axis[1] + b_value                                 
                 if start_axis[0] > end_axis[0]:                                   
@@ -171,7 +202,7 @@ class Arm:
                     elif x_axis[0] > x_axis[1]:                                      
                         return [x_axis[1], y2], [x_axis[0], y1]
             else:
-                return "Error Result"
+                return None
         elif x_offset == 0 and y_offset != 0:
             if math.fabs(start_axis[0]) < radius:
                 y = math.sqrt((radius * radius) - (start_axis[0] * start_axis[0]))
@@ -180,7 +211,7 @@ class Arm:
                 elif start_axis[1] < end_axis[1]:
                     return [start_axis[0], -y], [start_axis[0], y]
             else:
-                return "Error Y"
+                return None
         elif x_offset != 0 and y_offset == 0:
             if math.fabs(start_axis[1]) < radius:
                 x = math.sqrt((radius * radius) - (start_axis[1] * start_axis[1]))
@@ -189,9 +220,9 @@ class Arm:
                 elif start_axis[0] < end_axis[0]:
                     return [-x, start_axis[1]], [x, start_axis[1]]
             else:
-                return "Error X"
+                return None
         else:
-            return "Error XY"
+            return None
     #Determine whether a point is range of the ball
     def is_point_inside_sphere(self, x, y, z, radius):   
         distance_to_origin = math.sqrt(x**2 + y**2 + (z-self.ORIGINAL_HEIGHT)**2)  
@@ -201,39 +232,73 @@ class Arm:
             return 1 
         else:  
             return 2 
+    #Set the radius of the exclusion sphere around the shoulder axis
+    def setBaseRadius(self, radius):
+        self.base_radius = radius
+    #Reachable, inside the joint limits and outside the exclusion sphere, for every point of an (N,3) array
+    def pointsInWorkspace(self, axis):
+        axis = np.asarray(axis, dtype=float).reshape(-1, 3)
+        angle, valid = self.solveAngleBatch(axis)
+        return valid & self.anglesInLimits(angle) & self.outsideBase(axis)
+    #Check every interpolated path against the workspace field before the first pulse is sent
+    def setWorkspaceCheck(self, enable):
+        if enable:
+            from workspaceField import WorkspaceField
+            self.workspaceField = WorkspaceField(self)
+        else:
+            self.workspaceField = None
+    #Swept volume of a joint-space move. The axes ramp independently, so the joint angles are sampled along
+    #the real per-axis profiles at samples instants and every sample is checked against the joint limits
+    #and the base exclusion sphere, like the end point of rapidMove
+    def sweptVolumeValid(self, start_angle, end_angle, samples=64):
+        delta = [end_angle[i] - start_angle[i] for i in range(3)]
+        pulse_count = [round(self.armDriver.angleToPulseCount(math.fabs(delta[i]))) for i in range(3)]
+        intervals = self.armDriver.rapidIntervals(pulse_count)
+        duration = max(sum(axis_intervals) for axis_intervals in intervals)
+        moment = np.linspace(0, duration, samples)
+        angle = np.zeros((samples, 3))
+        for i in range(3):
+            if pulse_count[i] == 0:
+                angle[:,i] = start_angle[i]
+                continue
+            done = np.searchsorted(np.cumsum(intervals[i]), moment, side='right')
+            angle[:,i] = start_angle[i] + delta[i] * done / pulse_count[i]
+        return bool((self.anglesInLimits(angle) & self.outsideBase(self.angleToCoordinataBatch(angle))).all())
+    #Joint limits of an (N,3) array of solved angles once offsetAngle is applied, to within a microstep
+    #because the sensor pose sits on them
+    def anglesInLimits(self, angle):
+        angle = np.asarray(angle, dtype=float).reshape(-1, 3) + np.asarray(self.offsetAngle, dtype=float)
+        angleA = 180 - angle[:,1] - angle[:,2]
+        e = MICROSTEP_ANGLE
+        with np.errstate(invalid='ignore'):
+            return ((self.arm_limit_angle1[0] - e <= angleA) & (angleA <= self.arm_limit_angle1[1] + e) &
+                    (self.arm_limit_angle2[0] - e <= angle[:,1]) & (angle[:,1] <= self.arm_limit_angle2[1] + e) &
+                    (self.arm_limit_angle3[0] - e <= angle[:,2]) & (angle[:,2] <= self.arm_limit_angle3[1] + e))
+    #Points of an (N,3) array outside the base exclusion sphere
+    def outsideBase(self, axis):
+        axis = np.asarray(axis, dtype=float).reshape(-1, 3)
+        distance = np.sqrt(axis[:,0]**2 + axis[:,1]**2 + (axis[:,2] - self.ORIGINAL_HEIGHT)**2)
+        return distance >= self.base_radius
     #Based on the coordinates, radius of the circle, calculate the coordinate positions of the two points intersecting the circle, if the line does not intersect the circle, return [0, 0]
     def calculate_valid_axis(self, start_axis, end_axis, radius):
-        axis = self.calculate_axis(start_axis, end_axis, radius)            
-        if axis != "Error Result" and axis != "Error X" and axis != "Error Y" and axis != "Error XY":
-            if self.point_is_between_line(start_axis, end_axis, axis[0]) and self.point_is_between_line(start_axis, end_axis, axis[1]): 
-                z = self.calculate_z_coordinate(start_axis, end_axis, axis[0]) 
-                if z != "Error Result":
-                    return [1, 2], [axis[0][0], axis[0][1], z], [axis[1][0], axis[1][1], z] 
-                else:
-                    return [0, 0], [0, 0, 0], [0, 0, 0]
-            elif self.point_is_between_line(start_axis, end_axis, axis[0]) and not self.point_is_between_line(start_axis, end_axis, axis[1]):
-                z = self.calculate_z_coordinate(start_axis, end_axis, axis[0])
-                if round(start_axis[0], 2) != round(axis[0][0], 2) or round(start_axis[1], 2) != round(axis[0][1], 2):
-                    return [1, 1], [axis[0][0], axis[0][1], z], [0, 0, 0]
-                else:
-                    if (round(math.pow(end_axis[0], 2), 2) + round(math.pow(end_axis[1], 2), 2)) > math.pow(radius, 2):   
-                        return [1, 1], [end_axis[0], end_axis[1], end_axis[2]], [0, 0, 0]
-                    else:                                                                                                 
-                        return [1, 0], [0, 0, 0], [0, 0, 0]        
-            elif not self.point_is_between_line(start_axis, end_axis, axis[0]) and self.point_is_between_line(start_axis, end_axis, axis[1]):
-                z = self.calculate_z_coordinate(start_axis, end_axis, axis[1])
-                if round(start_axis[0], 2) != round(axis[1][0], 2) or round(start_axis[1], 2) != round(axis[1][1], 2):
-                    return [1, 1], [axis[1][0], axis[1][1], z], [0, 0, 0]
-                else:
-                    if (round(math.pow(end_axis[0], 2), 2) + round(math.pow(end_axis[1], 2), 2)) > math.pow(radius, 2):   
-                        return [1, 1], [end_axis[0], end_axis[1], end_axis[2]], [0, 0, 0]
-                    else:                                                                                                
-                        return [1, 0], [0, 0, 0], [0, 0, 0]  
-            else:
-                return [0, 0], [0, 0, 0], [0, 0, 0]
-        else:
-            #print("Line segments do not intersect the circle, or parallel the x and y axes.")
-            return [0, 0], [0, 0, 0], [0, 0, 0]
+        status, entry, exit, t_entry, t_exit = geometryKernel.segmentIntersections([start_axis], [end_axis], (0, 0), radius, 2)
+        length = math.hypot(end_axis[0] - start_axis[0], end_axis[1] - start_axis[1])
+        e = 0.005 / length if length != 0 else 0                 # points are compared to 0.01 mm
+        direction = np.asarray(end_axis, dtype=float) - np.asarray(start_axis, dtype=float)
+        axis = [(start_axis + t * direction).tolist() for t in (t_entry[0], t_exit[0]) if -e <= t <= 1 + e]
+        if len(axis) == 2:
+            return [1, 2], axis[0], axis[1]
+        elif len(axis) == 1:
+            if round(start_axis[0], 2) != round(axis[0][0], 2) or round(start_axis[1], 2) != round(axis[0][1], 2):
+                return [1, 1], axis[0], [0, 0, 0]
+            #Starting on the circle: leaving it goes to end_axis, moving inward crosses nothing
+            if (round(math.pow(end_axis[0], 2), 2) + round(math.pow(end_axis[1], 2), 2)) > math.pow(radius, 2):
+                return [1, 1], [end_axis[0], end_axis[1], end_axis[2]], [0, 0, 0]
+            return [1, 0], [0, 0, 0], [0, 0, 0]
+        return [0, 0], [0, 0, 0], [0, 0, 0]
+    #Status of N segments against the exclusion sphere of the base, with their entry and exit points
+    def segmentsHitBase(self, start_axis, end_axis):
+        return geometryKernel.segmentSphereIntersections(start_axis, end_axis, self.base_radius, [0, 0, self.ORIGINAL_HEIGHT])
     #Adjust the z-axis according to the X-axis
     def setPlaneXZ(self, x1, x2, zz1, zz2):
         self.plane_x_z[0] = float(x1)
@@ -264,30 +329,50 @@ class Arm:
     #Set the arm clamp length
     def setClampLength(self, length):
         self.CLAMP_LENGTH = length
+        self.reachEnvelope.invalidate()
     #Set the arm clamp height
     def setClampHeight(self, height):
         self.CLAMP_HEIGHT = height 
     #Set the height of the rotating shaft of the mechanical arm from the bottom surface
     def setOriginHeight(self, height):
         self.ORIGINAL_HEIGHT = height
+        self.reachEnvelope.invalidate()
     #Set the height between the bottom of the robot arm and the ground
     def setGroundHeight(self, height):
         self.GROUND_HEIGHT = height
+        self.reachEnvelope.invalidate()
     #Set the height of the pen at the end of the robot arm
     def setPenHeight(self, height):
         self.PEN_HEIGHT = height
+        self.reachEnvelope.invalidate()
     #Set the stepper motor pulse frequency
     def setFrequency(self, frequency):
         self.armFrequency = [frequency for i in range(3)] 
         self.armDriver.setA4988ClkFrequency(self.armFrequency)
+    #Set the stepper motor speed profile: 0 constant frequency, 1 trapezoidal, 2 S-curve
+    def setProfileMode(self, mode):
+        self.armDriver.setProfileMode(mode)
+    #Set the maximum angular velocity (degrees per second) of each stepper motor
+    def setMaxVelocity(self, velocity):
+        self.armDriver.setMaxVelocity(velocity)
+    #Set the maximum angular acceleration (degrees per second squared) of each stepper motor
+    def setMaxAcceleration(self, acceleration):
+        self.armDriver.setMaxAcceleration(acceleration)
     #Set the stepper motor subdivision mode
     def setMsxMode(self, mode):
         self.armDriver.setA4988MsxMode(mode)
+    #Let long moves switch to a coarser subdivision mode (down to coarsest_mode) and back
+    def setMicrostepSwitching(self, enable, coarsest_mode=1):
+        self.armDriver.setMicrostepSwitching(enable, coarsest_mode)
     #Set stepper motor enable and disable
     def setArmEnable(self, enable):
         self.armDriver.setA4988Enable(enable)
+    #Set the homing method: 0 six slow sweeps per axis, 1 fast seek with slow edge approach, 2 fast and parallel
+    def setHomingMode(self, mode):
+        self.armDriver.setHomingMode(mode)
     #Set the robot arm to calibrate the sensor center position
     def setArmToSensorPoint(self):
+        self.waitMotion()
         pulse_count = self.armDriver.caliSensorPoint()
         self.last_axis = self.angleToCoordinata(self.armDriver.lastAngle)  
         tempFrequency= self.armFrequency[0]
@@ -296,15 +381,99 @@ class Arm:
         self.armDriver.moveStepMotorToTargetAngle(angle1) 
         self.setFrequency(tempFrequency)
         return pulse_count
-    #Move the arm to the center of the sensor
-    def setArmToSensorPointNoAdjust(self, pulse_count):
+    #Move the arm to the center of the sensor; with verify=True the offset move is skipped and False is
+    #returned when the sensor widths no longer match pulse_count
+    def setArmToSensorPointNoAdjust(self, pulse_count, verify=False):
+        self.waitMotion()
         self.armDriver.gotoSensorPoint(pulse_count)
+        if verify and not self.armDriver.verifySensorPoint(pulse_count):
+            return False
         self.last_axis = self.angleToCoordinata(self.armDriver.lastAngle)
         tempFrequency= self.armFrequency[0]
         self.setFrequency(1000)
         angle1 = [(self.offsetAngle[i] + self.armDriver.lastAngle[i]) for i in range(3)]    # Deviation Angle calibration
         self.armDriver.moveStepMotorToTargetAngle(angle1) 
         self.setFrequency(tempFrequency)
+        return True
+    #Calibrate from the stored sensor half widths when they are valid for this hardware, otherwise run the
+    #full calibration and store the result
+    def setArmToSensorPointCached(self, path=calibrationCache.CALIBRATION_FILE, max_age=None):
+        fingerprint = calibrationCache.hardwareFingerprint(self.armDriver)
+        pulse_count = calibrationCache.loadCalibration(fingerprint, path, max_age)
+        if pulse_count is not None and self.setArmToSensorPointNoAdjust(pulse_count, verify=True):
+            return pulse_count
+        pulse_count = self.setArmToSensorPoint()
+        try:
+            calibrationCache.saveCalibration(pulse_count, fingerprint, path)
+        except OSError as e:
+            print("robotArm.py, calibration not saved:", e)
+        return pulse_count
+
+    #Set the maximum distance (mm) the joint-space path may stray from the straight line in mode 3
+    def setChordTolerance(self, tolerance):
+        self.chordTolerance = tolerance
+    #Distance from point p to the straight line through a and b
+    def distanceToLine(self, p, a, b):
+        ab = [b[i] - a[i] for i in range(3)]
+        ap = [p[i] - a[i] for i in range(3)]
+        length = math.sqrt(ab[0]**2 + ab[1]**2 + ab[2]**2)
+        if length == 0:
+            return math.sqrt(ap[0]**2 + ap[1]**2 + ap[2]**2)
+        cross = [ap[1]*ab[2] - ap[2]*ab[1], ap[2]*ab[0] - ap[0]*ab[2], ap[0]*ab[1] - ap[1]*ab[0]]
+        return math.sqrt(cross[0]**2 + cross[1]**2 + cross[2]**2) / length
+    #Joint angles of one point, ValueError instead of a math domain error when it is out of reach
+    def reachableAngle(self, point):
+        angle, valid = self.solveAngleBatch(point)
+        if not valid[0]:
+            raise ValueError("robotArm.py, target point out of reach: %s" % (list(point),))
+        return angle[0].tolist()
+    #Split a straight line into as few points as possible so that moving linearly in joint space
+    #between them never strays more than chordTolerance from the line
+    def subdivideLine(self, start_point, end_point, max_depth=16):
+        def pointAt(t):
+            return [start_point[i] + (end_point[i] - start_point[i]) * t for i in range(3)]
+        start_angle = self.reachableAngle(start_point)
+        end_angle = self.reachableAngle(end_point)
+        points = [start_point]
+        stack = [(1.0, end_angle, 0)]
+        t0, angle0 = 0.0, start_angle
+        while stack:
+            t1, angle1, depth = stack[-1]
+            error = 0
+            if depth < max_depth:
+                for u in (0.25, 0.5, 0.75):
+                    angle = [angle0[i] + (angle1[i] - angle0[i]) * u for i in range(3)]
+                    error = max(error, self.distanceToLine(self.angleToCoordinata(angle), start_point, end_point))
+                    if error > self.chordTolerance:
+                        break
+            if error > self.chordTolerance:
+                t_mid = (t0 + t1) / 2
+                stack.append((t_mid, self.reachableAngle(pointAt(t_mid)), depth + 1))
+            else:
+                stack.pop()
+                points.append(pointAt(t1))
+                t0, angle0 = t1, angle1
+        return points
+    #Wait until every queued move has been sent to the stepper motors; a failed move is raised here
+    def waitMotion(self):
+        try:
+            self.motionExecutor.wait()
+        except Exception:
+            self.motionFailed()
+            raise
+    #After a failed move the queued moves are dropped: read the arm position back from the steps sent
+    def motionFailed(self):
+        angle = [self.armDriver.lastAngle[i] - self.offsetAngle[i] for i in range(3)]
+        axis = self.angleToCoordinata(angle)
+        self.last_axis = [axis[0] - self.last_x_offset, axis[1] - self.last_y_offset, axis[2] - self.last_z_offset]
+    #Stop the motion worker once the queued moves are done
+    def stopMotion(self):
+        self.motionExecutor.stop()
+    #Restart the motion worker with or without SCHED_FIFO priority, CPU pinning and locked memory
+    def setRealtimeMode(self, enable, priority=50, cpu=None):
+        self.motionExecutor.stop()
+        self.motionExecutor.setRealtime(enable, priority, cpu)
+        self.motionExecutor.start()
 
     #Set the stepper motor calibration offset Angle
     def setArmOffseAngle(self, offsetAngle):
@@ -355,8 +524,84 @@ class Arm:
         angle7 = 90 - angle0
         x = dPlane * math.sin(self.angleToRadian(angle7))
         return [x, y, z]
-    #Control the robot arm to move to the corresponding coordinates
-    def moveStepMotorToTargetAxis(self, axis, mode=0):
+    #Keep compiled moves so repeated ones skip IK, subdivision and pulse planning. max_bytes caps the pulse
+    #streams held in memory; persist also saves them to trajectory_cache/ for the next start
+    def setTrajectoryCache(self, enable, max_bytes=16 * 1024 * 1024, persist=False):
+        if enable:
+            from trajectoryCache import TrajectoryCache, TRAJECTORY_DIR
+            self.trajectoryCache = TrajectoryCache(max_bytes, TRAJECTORY_DIR if persist else None)
+        else:
+            self.trajectoryCache = None
+    #Everything a compiled move depends on: both end points (offsets included), the mode, the geometry and
+    #the drive settings. The start ledger position is checked again when the move is replayed
+    def trajectoryKey(self, start_point, end_point, mode):
+        driver = self.armDriver
+        move = [list(start_point), list(end_point), mode, self.CLAMP_LENGTH, self.ORIGINAL_HEIGHT, self.GROUND_HEIGHT,
+                self.PEN_HEIGHT, self.L1_LENGTH, self.L2_LENGTH, self.offsetAngle, self.arm_limit_angle1,
+                self.arm_limit_angle2, self.arm_limit_angle3, self.base_radius, self.chordTolerance,
+                self.workspaceField is not None,
+                driver.A4988ClkFrequency, driver.A4988MsxModeValue, driver.profileMode, driver.maxVelocity,
+                driver.maxAcceleration, driver.microstepSwitching, driver.coarsestMsxMode, driver.microstepMinPulses]
+        return hashlib.sha1(json.dumps(move).encode()).hexdigest()
+    #Queue planned joint angles, through the trajectory cache when key is given; entry is the cached move on a hit
+    def queueAngles(self, angles, rapid, key, entry=None):
+        try:
+            if key is not None:
+                if entry is None:
+                    entry = {"targets": angles, "rapid": rapid or None}
+                self.motionExecutor.enqueueCompiled(entry, self.trajectoryCache, key)
+            elif rapid:
+                self.motionExecutor.enqueueRapid(angles[0])
+            else:
+                self.motionExecutor.enqueueMove(angles)
+        except Exception:
+            self.motionFailed()
+            raise
+    #Convert an (N,3) array of coordinates to angles in one call; unreachable points are NaN and False in the mask
+    def coordinateToAngleBatch(self, axis, offset=False):
+        angle, valid = self.solveAngleBatch(axis)
+        if offset:
+            angle = angle + np.asarray(self.offsetAngle, dtype=float)
+        return angle, valid
+    #Exact inverse kinematics of an (N,3) array of coordinates
+    def solveAngleBatch(self, axis):
+        axis = np.asarray(axis, dtype=float).reshape(-1, 3)
+        angle0 = self.radianToAngle(np.arctan2(axis[:,1], axis[:,0]))
+        dPlane = np.sqrt(axis[:,0]**2 + axis[:,1]**2)
+        d1Plane = dPlane - self.CLAMP_LENGTH
+        zHeight = axis[:,2] - self.ORIGINAL_HEIGHT - self.GROUND_HEIGHT + self.PEN_HEIGHT
+        dHypotenuse = np.sqrt(d1Plane**2 + zHeight**2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cosA = (self.L1_LENGTH**2 + dHypotenuse**2 - self.L2_LENGTH**2) / np.fabs(2 * self.L1_LENGTH * dHypotenuse)
+            valid = np.isfinite(cosA) & (cosA >= -1) & (cosA <= 1)
+            angle1 = self.radianToAngle(np.arccos(np.where(valid, cosA, np.nan)))
+        angle2 = self.radianToAngle(np.arctan2(np.fabs(zHeight), d1Plane))
+        angle3 = np.where(zHeight > 0, angle1 + angle2, angle1 - angle2)
+        angle4 = 180 - (2 * angle1)
+        angle5 = 180 - (angle3 + angle4)
+        angle = np.stack([angle0, angle3, angle5], axis=1)
+        return angle, valid
+    #Convert an (N,3) array of angles to coordinates in one call; offset=True removes offsetAngle first
+    def angleToCoordinataBatch(self, angle, offset=False):
+        angle = np.asarray(angle, dtype=float).reshape(-1, 3)
+        if offset:
+            angle = angle - np.asarray(self.offsetAngle, dtype=float)
+        angle0 = angle[:,0]
+        angle3 = angle[:,1]
+        angle5 = angle[:,2]
+        angle4 = 180-angle3-angle5
+        angle1 = (180-angle4)/2
+        angle2 = np.fabs(angle1-angle3)
+        dHypotenuse = np.sqrt(self.L1_LENGTH**2 + self.L2_LENGTH**2 - 2 * self.L1_LENGTH * self.L2_LENGTH * np.cos(self.angleToRadian(angle4)))
+        zHeight = dHypotenuse * np.sin(self.angleToRadian(angle2))
+        z = np.where(angle1 > angle3, -zHeight, zHeight) + self.ORIGINAL_HEIGHT + self.GROUND_HEIGHT - self.PEN_HEIGHT
+        dPlane = dHypotenuse * np.sin(self.angleToRadian(90 - angle2)) + self.CLAMP_LENGTH
+        y = dPlane * np.sin(self.angleToRadian(angle0))
+        x = dPlane * np.sin(self.angleToRadian(90 - angle0))
+        return np.stack([x, y, z], axis=1)
+    #Control the robot arm to move to the corresponding coordinates, wait=False returns once the move is queued.
+    #mode 0 10 points/mm, 1 end point only, 2 1 point/mm, 3 adaptive line, 4 joint-space rapid move
+    def moveStepMotorToTargetAxis(self, axis, mode=0, wait=True):
         start_axis = self.last_axis.copy()                       
         end_axis = axis.copy()                                   
         self.last_axis = axis.copy()                            
@@ -380,33 +625,78 @@ class Arm:
         buf_value.sort(reverse=True)                                                
         max_value = buf_value[0]                                                   
         if max_value!=0:
-            processing_axis = []
-            if mode==0:
-                subdivision = 10
-                for i in range(int(max_value*subdivision)+1):
-                    buf_value[0] = (start_axis[0]+self.last_x_offset) + ((calculated_value[0]/max_value/subdivision)*i)
-                    buf_value[1] = (start_axis[1]+self.last_y_offset) + ((calculated_value[1]/max_value/subdivision)*i)
-                    buf_value[2] = (start_axis[2]+self.last_z_offset) + ((calculated_value[2]/max_value/subdivision)*i)
-                    processing_axis.append(buf_value.copy())
-            elif mode == 1:
-                buf_value[0] = (start_axis[0]+self.last_x_offset) + (calculated_value[0])
-                buf_value[1] = (start_axis[1]+self.last_y_offset) + (calculated_value[1])
-                buf_value[2] = (start_axis[2]+self.last_z_offset) + (calculated_value[2])
-                processing_axis.append(buf_value.copy())
-            elif mode == 2:
-                subdivision = 1
-                for i in range(int(max_value*subdivision)+1):
-                    buf_value[0] = (start_axis[0]+self.last_x_offset) + ((calculated_value[0]/max_value/subdivision)*i)
-                    buf_value[1] = (start_axis[1]+self.last_y_offset) + ((calculated_value[1]/max_value/subdivision)*i)
-                    buf_value[2] = (start_axis[2]+self.last_z_offset) + ((calculated_value[2]/max_value/subdivision)*i)
-                    processing_axis.append(buf_value.copy())
-            for i in range(len(processing_axis)):
-                angle = self.coordinateToAngle(processing_axis[i])                           
-                angle1 = [(self.offsetAngle[i] + angle[i]) for i in range(3)]    # Deviation Angle calibration
-                self.armDriver.moveStepMotorToTargetAngle(angle1) 
+            start_point = np.array([start_axis[0]+self.last_x_offset, start_axis[1]+self.last_y_offset, start_axis[2]+self.last_z_offset])
+            end_point = start_point + np.array(calculated_value)
+            key = None
+            entry = None
+            if self.trajectoryCache is not None:
+                key = self.trajectoryKey(start_point.tolist(), end_point.tolist(), mode)
+                entry = self.trajectoryCache.get(key)
+            if entry is not None:
+                self.queueAngles(entry["targets"], entry["rapid"] is not None, key, entry)    # checked and planned when it was compiled
+            elif mode == 4:
+                self.rapidMove(start_point, end_point, start_axis, key)
+            else:
+                self.lineMove(start_point, calculated_value, max_value, mode, start_axis, key)
         self.last_x_offset = self.current_x_offset                                      
         self.last_y_offset = self.current_y_offset                                         
         self.last_z_offset = self.current_z_offset                                        
+        if wait:
+            self.waitMotion()
+            if mode == 4:
+                return self.armDriver.rapidReport
+    #Modes 0-3 of moveStepMotorToTargetAxis: interpolate the straight line and solve IK for every point
+    def lineMove(self, start_point, calculated_value, max_value, mode, start_axis, key):
+        if self.workspaceField is not None:
+            #Straight-line modes are checked every millimetre, the arm is already at the start point
+            if mode == 1:
+                path = [start_point + np.array(calculated_value)]
+            else:
+                step = np.arange(1, int(math.ceil(max_value)) + 1) / math.ceil(max_value)
+                path = start_point + np.outer(step, np.array(calculated_value))
+            path_valid, index, furthest = self.workspaceField.validatePath(path)
+            if not path_valid:
+                self.last_axis = start_axis
+                raise ValueError("robotArm.py, path leaves the workspace at %s, furthest reachable point %s" % (
+                    np.asarray(path)[index].tolist(), furthest))
+        if mode==0 or mode==2:
+            subdivision = 10 if mode==0 else 1
+            step = np.arange(int(max_value*subdivision)+1)
+            processing_axis = start_point + np.outer(step, np.array(calculated_value)/max_value/subdivision)
+        elif mode == 1:
+            processing_axis = [start_point + np.array(calculated_value)]
+        elif mode == 3:
+            end_point = [start_point[i] + calculated_value[i] for i in range(3)]
+            step = np.arange(int(math.ceil(max_value)) + 1) / math.ceil(max_value)
+            line = start_point + np.outer(step, np.array(calculated_value))
+            angle, valid = self.coordinateToAngleBatch(line)
+            if not valid.all():
+                self.last_axis = start_axis
+                raise ValueError("robotArm.py, target point out of reach: %s" % (line[~valid][0].tolist(),))
+            try:
+                processing_axis = self.subdivideLine(start_point.tolist(), end_point)
+            except ValueError:
+                self.last_axis = start_axis
+                raise
+        else:
+            processing_axis = []
+        if len(processing_axis) != 0:
+            angle, valid = self.coordinateToAngleBatch(processing_axis, offset=True)    # Deviation Angle calibration
+            if not valid.all():
+                self.last_axis = start_axis
+                raise ValueError("robotArm.py, target point out of reach: %s" % (np.asarray(processing_axis)[~valid][0].tolist(),))
+            self.queueAngles(angle.tolist(), False, key)
+    #Mode 4 of moveStepMotorToTargetAxis: go straight to the target angles with every axis at its own maximum
+    #velocity and acceleration. No intermediate IK; only the end point and the swept volume are checked
+    def rapidMove(self, start_point, end_point, start_axis, key):
+        angle, valid = self.solveAngleBatch([start_point, end_point])
+        if not self.pointsInWorkspace(end_point)[0]:
+            self.last_axis = start_axis
+            raise ValueError("robotArm.py, target point outside the workspace: %s" % (end_point.tolist(),))
+        if valid[0] and not self.sweptVolumeValid(angle[0], angle[1]):
+            self.last_axis = start_axis
+            raise ValueError("robotArm.py, rapid move to %s sweeps outside the workspace" % (end_point.tolist(),))
+        self.queueAngles([(angle[1] + np.asarray(self.offsetAngle, dtype=float)).tolist()], True, key)
     
 """if __name__ == '__main__':
     import os
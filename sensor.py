@@ -2,11 +2,76 @@
 #!/usr/bin/env python
 
 from gpiozero import DigitalInputDevice  
+import collections
+import threading
+import time
 
 class TCRT5000: 
-    def __init__(self):
+    def __init__(self, history=256, debounce=0.0002):
         self.TCRT5000_PIN = [8,11,7]
-        self.sensors = [DigitalInputDevice(pin, pull_up=False, bounce_time=1) for pin in self.TCRT5000_PIN] 
+        self.sensors = [DigitalInputDevice(pin, pull_up=False) for pin in self.TCRT5000_PIN] 
+        self.debounce_ns = round(debounce * 1000000000)          # edges closer than this to the last one are bounce
+        self.edges = collections.deque(maxlen=history)           # (monotonic_ns, sensor index, level, step count)
+        self.edgeLock = threading.Lock()
+        self.stepCounter = None
+        self.lastLevel = [1 if sensor.is_active else 0 for sensor in self.sensors]
+        self.lastEdgeTime = [0 for sensor in self.sensors]
+        self.pendingEdge = [None for sensor in self.sensors]     # (monotonic_ns, step count) of the last bounce
+        self.settleTimer = [None for sensor in self.sensors]     # re-reads the pin once the debounce window is over
+        for i in range(len(self.sensors)):
+            self.sensors[i].when_activated = self.edgeCallback(i, 1)
+            self.sensors[i].when_deactivated = self.edgeCallback(i, 0)
+
+    #counter(index) returns the step count of the motor watched by sensor index
+    def setStepCounter(self, counter):
+        self.stepCounter = counter
+
+    def edgeCallback(self, index, level):
+        def callback():
+            self.recordEdge(index, level)
+        return callback
+
+    def recordEdge(self, index, level, timestamp=None):
+        if timestamp is None:
+            timestamp = time.monotonic_ns()
+        step_count = self.stepCounter(index) if self.stepCounter is not None else None
+        with self.edgeLock:
+            if level == self.lastLevel[index]:
+                return
+            if timestamp - self.lastEdgeTime[index] < self.debounce_ns:
+                #Bounce: the pin is read again when the window is over, so a burst that ends on the other
+                #level still records its last transition
+                self.pendingEdge[index] = (timestamp, step_count)
+                if self.settleTimer[index] is None:
+                    delay = max(self.lastEdgeTime[index] + self.debounce_ns - timestamp, 0) / 1000000000
+                    self.settleTimer[index] = threading.Timer(delay, self.settleEdge, args=(index,))
+                    self.settleTimer[index].daemon = True
+                    self.settleTimer[index].start()
+                return
+            self.lastLevel[index] = level
+            self.lastEdgeTime[index] = timestamp
+            self.edges.append((timestamp, index, level, step_count))
+
+    def settleEdge(self, index):
+        level = 1 if self.sensors[index].is_active else 0
+        with self.edgeLock:
+            self.settleTimer[index] = None
+            if level == self.lastLevel[index]:
+                return
+            timestamp, step_count = self.pendingEdge[index]
+            self.lastLevel[index] = level
+            self.lastEdgeTime[index] = timestamp
+            self.edges.append((timestamp, index, level, step_count))
+
+    #Edges recorded after since (monotonic_ns), optionally only those of one sensor and level
+    def readEdges(self, since=0, index=None, level=None):
+        with self.edgeLock:
+            edges = list(self.edges)
+        return [edge for edge in edges if edge[0] > since and (index is None or edge[1] == index) and (level is None or edge[2] == level)]
+
+    def clearEdges(self):
+        with self.edgeLock:
+            self.edges.clear()
 
     def readTCRT5000S1(self):
         return 1 if self.sensors[0].is_active else 0
@@ -21,47 +86,22 @@ class TCRT5000:
         return [s1,s2,s3]
     
     def stopTCRT5000ALL(self):
+        for timer in self.settleTimer:
+            if timer is not None:
+                timer.cancel()
         [self.sensors[i].close() for i in range(len(self.sensors))]
     
 if __name__ == '__main__':
     import os
     import time
-    current_state = [0,0,0]
-    sensor_count = [0,0,0]
-    sensor = TCRT5000()
+    sensor = TCRT5000(debounce=0.1)
+    last_time = 0
     try:
         while True:
-            sensor_state = sensor.readTCRT5000ALL()
-            print("sensor_state:", sensor_state)
-            if current_state[0] != sensor_state[0]:
-                time.sleep(0.1)
-                sensor_state = sensor.readTCRT5000ALL()
-                if current_state[0] != sensor_state[0]:
-                    current_state[0] = sensor_state[0]
-                    sensor_count[0] = sensor_count[0] + 1
-                if sensor_count[0] >= 2:
-                    sensor_count[0] = 0
-                    print("Sensor 1 is triggered.")
-            elif current_state[1] != sensor_state[1]:
-                time.sleep(0.1)
-                sensor_state = sensor.readTCRT5000ALL()
-                if current_state[1] != sensor_state[1]:
-                    current_state[1] = sensor_state[1]
-                    sensor_count[1] = sensor_count[1] + 1
-                if sensor_count[1] >= 2:
-                    sensor_count[1] = 0
-                    print("Sensor 2 is triggered.")
-            elif current_state[2] != sensor_state[2]:
-                time.sleep(0.1)
-                sensor_state = sensor.readTCRT5000ALL()
-                if current_state[2] != sensor_state[2]:
-                    current_state[2] = sensor_state[2]
-                    sensor_count[2] = sensor_count[2] + 1
-                if sensor_count[2] >= 2:
-                    sensor_count[2] = 0
-                    print("Sensor 3 is triggered.")
-            else:
-                time.sleep(0.3)
+            for timestamp, index, level, step_count in sensor.readEdges(last_time):
+                last_time = timestamp
+                print("Sensor %d is %s." % (index + 1, "triggered" if level == 1 else "released"))
+            time.sleep(0.1)
     except KeyboardInterrupt:  # When 'Ctrl+C' is pressed, the child program destroy() will be  executed.
         pass
 
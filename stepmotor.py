@@ -4,9 +4,16 @@
 from gpiozero import OutputDevice  
 import time
 import math
-import threading
 import sensor
-import messageThread
+from pulseEngine import PulseEngine
+import motionProfile
+
+HOMING_SWEEP = 0
+HOMING_FAST = 1
+HOMING_PARALLEL = 2
+
+MICROSTEP_RESOLUTION = 16                                       # ledger unit: 1/16 step, the finest A4988 mode
+MICROSTEP_ANGLE = 360 / 6 / 200 / MICROSTEP_RESOLUTION          # joint degrees per ledger unit
 
 class StepMotor:
     def __init__(self):
@@ -17,14 +24,37 @@ class StepMotor:
         self.A4988_STEP = [4, 17, 22]                       
         self.tcrt5000 = sensor.TCRT5000()                        
         self.initA4988()                                         
+        self.initPulseEngine()
         self.setA4988Enable(1)                               
         self.setA4988MsxMode(5)                                
         self.A4988MsxModeValue = 5                              
         self.A4988ClkFrequency = [1000,1000,1000]             
-        self.pulse_margin = [0,0,0]                             
-        self.pulse_margin_dir = [0,0,0]                         
+        self.profileMode = motionProfile.PROFILE_CONSTANT
+        self.maxVelocity = [90, 90, 90]                          # degrees per second
+        self.maxAcceleration = [180, 180, 180]                  # degrees per second squared
         self.zeroAngle = [90, 110, -12]                          
-        self.lastAngle = self.zeroAngle.copy() 
+        self.plannedPosition = [0,0,0]                          # ledger after every planned segment, microsteps from zeroAngle
+        self.phaseOrigin = [0,0,0]                               # ledger value of the translator home state
+        self.microstepSwitching = False                          # run long paths in a coarser MSx mode
+        self.coarsestMsxMode = 1
+        self.microstepMinPulses = 50                             # coarse pulses the longest joint travel must take
+        self.rapidReport = None                                  # estimated and actual duration of the last rapid move
+        self.recording = None                                    # pulse streams sent while compileMove runs
+        self.homingMode = HOMING_SWEEP
+        self.homingChunk = 16                                    # pulses per fast seek train
+        self.homingSeekFrequency = 4000                          # cruise speed of seeks, reached by ramping from pullInFrequency
+        self.pullInFrequency = 1000                              # highest frequency a motor may start or stop at
+        self.homingCreepFrequency = 1000
+        self.homingSettle = 0.05                                 # seconds between sweeps
+        self.homingTolerance = 4                                 # pulses the sweep widths may differ by
+        self.homingMaxSweeps = 6
+        self.homingInterlocks = {                                # phase -> phases that must be finished first
+            'seek1': ['seek2', 'seek3'],                         # the base only turns with the arm folded onto its sensors
+            'mid1': ['seek1'],
+            'mid2': ['seek1'],
+            'mid3': ['seek1', 'mid2'],                           # the elbow is swept once the shoulder is centered
+        }
+        self.tcrt5000.setStepCounter(self.sensorStepCount)
 
     def initA4988(self):
         self.MODULE_EN = OutputDevice(self.A4988_EN, initial_value=False) 
@@ -38,6 +68,11 @@ class StepMotor:
         self.MODULE_STEP_2 = OutputDevice(self.A4988_STEP[1], initial_value=False) 
         self.MODULE_STEP_3 = OutputDevice(self.A4988_STEP[2], initial_value=False) 
 
+    def initPulseEngine(self):
+        self.pulseEngine = PulseEngine([self.MODULE_STEP_3, self.MODULE_STEP_2, self.MODULE_STEP_1],
+                                       [self.MODULE_DIR_3, self.MODULE_DIR_2, self.MODULE_DIR_1],
+                                       self.motorDirection(1))
+
     def stopA4988(self):
         self.MODULE_EN.close()
         self.MODULE_MS1.close()
@@ -77,6 +112,10 @@ class StepMotor:
             pll = 16
         return pll
     
+    #Ledger units moved by one pulse in the current subdivision mode
+    def microstepsPerPulse(self):
+        return MICROSTEP_RESOLUTION // self.readA4988Msx()
+
     def setA4988MsxMode(self, mode):
         if mode == 1:
             self.A4988MsxModeValue = 1
@@ -96,50 +135,98 @@ class StepMotor:
         else:
             self.A4988MsxModeValue = 5
             self.setA4988MSx(1,1,1) 
+        self.pulseEngine.step_units = self.microstepsPerPulse()
     
     def setA4988ClkFrequency(self, frequency):
         self.A4988ClkFrequency = frequency
+
+    #Select the speed profile: 0 constant frequency, 1 trapezoidal, 2 S-curve
+    def setProfileMode(self, mode):
+        self.profileMode = mode
+
+    def setMaxVelocity(self, velocity):
+        self.maxVelocity = velocity.copy()
+
+    def setMaxAcceleration(self, acceleration):
+        self.maxAcceleration = acceleration.copy()
+
+    #Pulse periods of one axis; the profile starts and ends at pulse_frequency
+    def axisIntervals(self, axis, pulse_count, pulse_frequency):
+        if pulse_count == 0 or pulse_frequency == 0:
+            return ()
+        if self.profileMode == motionProfile.PROFILE_CONSTANT:
+            return self.pulseEngine.constantIntervals(pulse_count, pulse_frequency)
+        max_velocity = round(self.angleToPulseCount(self.maxVelocity[axis]))
+        acceleration = round(self.angleToPulseCount(self.maxAcceleration[axis]))
+        return motionProfile.stepIntervals(pulse_count, pulse_frequency, max_velocity, acceleration, self.profileMode)
     
     def myDelay(self, second):
-        microsecond = second * 1000000
-        start, end = 0,0
-        start = time.time()
-        t = (microsecond - 33) / 1000000
-        while end - start < t:
-            end = time.time()
-
-    def motorRun(self, motor_number, direction, pulse_count, pulse_frequency):
-        if pulse_count == 0 or pulse_frequency == 0:
-            return
+        self.pulseEngine.timer.sleep(second - 0.000033)
+
+    #Seconds of each wait spent spinning instead of sleeping; larger values trade CPU time for accuracy
+    def setTimerSpin(self, spin):
+        self.pulseEngine.timer.setSpin(spin)
+
+    #Deadline statistics of the pulse loop since the last reset
+    def timingReport(self, reset=False):
+        report = self.pulseEngine.timer.report()
+        if reset:
+            self.pulseEngine.timer.resetStats()
+        return report
+
+    def motorDirection(self, direction):
         turn_dir = direction
         if self.turn_direction == 1:
             if direction == 1:
                 turn_dir = 0
             elif direction == 0:
                 turn_dir = 1
-        pulse_period = 1 / pulse_frequency                      
-        half_pulse_period = pulse_period / 2                          
-        if motor_number == 1:  
-            self.setPinState(self.MODULE_DIR_3, turn_dir)                                      
-            for i in range(pulse_count):
-                self.setPinState(self.MODULE_STEP_3, 1)      
-                self.myDelay(half_pulse_period)
-                self.setPinState(self.MODULE_STEP_3, 0)   
-                self.myDelay(half_pulse_period)   
-        elif motor_number == 2:
-            self.setPinState(self.MODULE_DIR_2, turn_dir)     
-            for i in range(pulse_count):
-                self.setPinState(self.MODULE_STEP_2, 1)  
-                self.myDelay(half_pulse_period)
-                self.setPinState(self.MODULE_STEP_2, 0)  
-                self.myDelay(half_pulse_period)   
-        elif motor_number == 3:
-            self.setPinState(self.MODULE_DIR_1, turn_dir)     
-            for i in range(pulse_count):
-                self.setPinState(self.MODULE_STEP_1, 1)  
-                self.myDelay(half_pulse_period)
-                self.setPinState(self.MODULE_STEP_1, 0)  
-                self.myDelay(half_pulse_period)      
+        return turn_dir
+
+    #Set the DIR pins of the motors that are about to move
+    def setMotorDirection(self, direction, pulse_count):
+        dir_pins = [self.MODULE_DIR_3, self.MODULE_DIR_2, self.MODULE_DIR_1]
+        for i in range(3):
+            if pulse_count[i] != 0:
+                self.setPinState(dir_pins[i], self.motorDirection(direction[i]))
+                self.pulseEngine.setDirectionLevel(i, self.motorDirection(direction[i]))
+
+    #Pulse periods of a homing train: trains faster than pullInFrequency ramp up from it and back down
+    #at maxAcceleration, so short seek trains never start from standstill above the pull-in speed
+    def homingIntervals(self, axis, pulse_count, pulse_frequency):
+        if pulse_count == 0 or pulse_frequency == 0:
+            return ()
+        if pulse_frequency <= self.pullInFrequency:
+            return self.pulseEngine.constantIntervals(pulse_count, pulse_frequency)
+        acceleration = round(self.angleToPulseCount(self.maxAcceleration[axis]))
+        return motionProfile.stepIntervals(pulse_count, self.pullInFrequency, pulse_frequency, acceleration, motionProfile.PROFILE_TRAPEZOIDAL)
+
+    #Drive all three motors from one merged pulse schedule; ramp=True runs every train through
+    #homingIntervals whatever the profile mode
+    def multiMotorRun(self, direction, pulse_count, pulse_frequency, ramp=False):
+        pulse_count = [pulse_count[i] if pulse_frequency[i] != 0 else 0 for i in range(3)]
+        self.setMotorDirection(direction, pulse_count)
+        if ramp:
+            intervals = [self.homingIntervals(i, pulse_count[i], pulse_frequency[i]) for i in range(3)]
+        else:
+            intervals = [self.axisIntervals(i, pulse_count[i], pulse_frequency[i]) for i in range(3)]
+        units = self.microstepsPerPulse()
+        for i in range(3):
+            self.plannedPosition[i] = self.plannedPosition[i] + (units if direction[i] == 1 else -units) * pulse_count[i]
+        self.pulseEngine.run(intervals)
+
+    def motorRun(self, motor_number, direction, pulse_count, pulse_frequency, ramp=False):
+        if pulse_count == 0 or pulse_frequency == 0:
+            return
+        if motor_number not in (1, 2, 3):
+            return
+        directions = [0,0,0]
+        pulse_counts = [0,0,0]
+        frequencies = [0,0,0]
+        directions[motor_number-1] = direction
+        pulse_counts[motor_number-1] = pulse_count
+        frequencies[motor_number-1] = pulse_frequency
+        self.multiMotorRun(directions, pulse_counts, frequencies, ramp)
 
     def pulseCountToAngle(self, pulse_count):
         a4988Pll = self.readA4988Msx()
@@ -152,6 +239,30 @@ class StepMotor:
         else:
             pulse_count = (angle / 360) * 6 * 200 * a4988Pll
         return pulse_count
+    #Ledger position (microsteps from zeroAngle) nearest to a joint angle
+    def angleToPosition(self, angle, index):
+        return round((angle - self.zeroAngle[index]) / MICROSTEP_ANGLE)
+
+    def positionToAngle(self, position, index):
+        return self.zeroAngle[index] + position * MICROSTEP_ANGLE
+
+    #Commanded joint angles, derived from the integer ledger of every planned segment
+    @property
+    def lastAngle(self):
+        return [self.positionToAngle(self.plannedPosition[i], i) for i in range(3)]
+
+    #Setting the angle (e.g. to zeroAngle after homing) moves the ledger origin, not the motors
+    @lastAngle.setter
+    def lastAngle(self, angle):
+        for i in range(3):
+            self.plannedPosition[i] = self.angleToPosition(angle[i], i)
+            self.phaseOrigin[i] = self.phaseOrigin[i] + self.plannedPosition[i] - self.pulseEngine.position[i]
+            self.pulseEngine.position[i] = self.plannedPosition[i]
+
+    #Joint angles the pulses sent so far have reached
+    def currentAngle(self):
+        return [self.positionToAngle(self.pulseEngine.position[i], i) for i in range(3)]
+
     def angleToStepMotorParameter(self, targetAngle):
         valueAngle = [(self.lastAngle[i] - targetAngle[i]) for i in range(3)] 
         direction = [0,0,0]                                                   
@@ -164,7 +275,229 @@ class StepMotor:
             pulse_count[i] = self.angleToPulseCount(math.fabs(valueAngle[i])) 
         return direction, pulse_count                                         
 
+    #Select the homing method: 0 six slow sweeps per axis, 1 fast seek with slow edge approach,
+    #2 fast homing with the axes running at the same time
+    def setHomingMode(self, mode):
+        self.homingMode = mode
+
+    #Pulse counter of the motor watched by sensor index, stamped onto every sensor edge
+    def sensorStepCount(self, index):
+        return self.pulseEngine.position[index]
+
+    def readSensor(self, motor_number):
+        if motor_number == 1:
+            return self.tcrt5000.readTCRT5000S1()
+        elif motor_number == 2:
+            return self.tcrt5000.readTCRT5000S2()
+        return self.tcrt5000.readTCRT5000S3()
+
+    #Homing generators yield [direction, pulse_count, frequency] requests for their motor, or None to settle.
+    #Move until the sensor reads level in fast trains. With precise=True the recorded sensor edge tells how far
+    #the last train overran; the motor returns there and confirms the edge one pulse at a time.
+    #Returns the net pulses moved in direction. frequency defaults to homingSeekFrequency.
+    def seekSensorEdge(self, motor_number, direction, level, precise=True, frequency=None):
+        if frequency is None:
+            frequency = self.homingSeekFrequency
+        moved = 0
+        since = time.monotonic_ns()
+        while self.readSensor(motor_number) != level:
+            yield [direction, self.homingChunk, frequency]
+            moved = moved + self.homingChunk
+        if precise and moved != 0:
+            edges = self.tcrt5000.readEdges(since, motor_number - 1, level)
+            if len(edges) != 0 and edges[0][3] is not None:
+                overrun = math.fabs(self.pulseEngine.position[motor_number - 1] - edges[0][3]) / self.microstepsPerPulse()
+                overrun = min(round(overrun), self.homingChunk)
+            else:
+                overrun = self.homingChunk
+            if overrun != 0:
+                yield [1 - direction, overrun, frequency]
+                moved = moved - overrun
+            while self.readSensor(motor_number) == level:
+                yield [1 - direction, 1, self.homingCreepFrequency]
+                moved = moved - 1
+            while self.readSensor(motor_number) != level:
+                yield [direction, 1, self.homingCreepFrequency]
+                moved = moved + 1
+        return moved
+
+    #Fast two-phase version of gotoMidSensorPoint: sweeps stop once the measured widths agree
+    def homeAxisFast(self, motor_number, approach_dir, overshoot):
+        leave_dir = 1 - approach_dir
+        yield from self.seekSensorEdge(motor_number, leave_dir, 0, precise=False)
+        yield [leave_dir, overshoot, self.homingSeekFrequency]
+        direction = approach_dir
+        widths = []
+        for i in range(self.homingMaxSweeps):
+            yield from self.seekSensorEdge(motor_number, direction, 1)
+            yield [direction, 50, self.homingCreepFrequency]
+            width = 50 + (yield from self.seekSensorEdge(motor_number, direction, 0))
+            yield [direction, overshoot, self.homingSeekFrequency]
+            widths.append(width)
+            direction = 1 - direction
+            yield None
+            if len(widths) % 2 == 0 and max(widths) - min(widths) <= self.homingTolerance:
+                break
+        yield from self.seekSensorEdge(motor_number, approach_dir, 1)
+        half_pulse_count = sum(widths) / len(widths) / 2
+        yield [approach_dir, round(half_pulse_count), self.homingCreepFrequency]
+        return half_pulse_count
+
+    #Run one homing generator to completion on its motor
+    def runHomingAxis(self, motor_number, homing):
+        try:
+            request = next(homing)
+            while True:
+                if request is None:
+                    time.sleep(self.homingSettle)
+                else:
+                    self.motorRun(motor_number, request[0], request[1], request[2], ramp=True)
+                request = next(homing)
+        except StopIteration as stop:
+            return stop.value
+
+    #Run homing generators of several motors at the same time. phases maps a phase name to
+    #(motor_number, generator); a phase starts once every phase listed for it in interlocks has finished.
+    #Returns the value each generator returned.
+    def runHomingPhases(self, phases, interlocks):
+        waiting = dict(phases)
+        active = {}                                              # name -> [motor, generator, request, settle deadline]
+        results = {}
+        def advance(name):
+            state = active[name]
+            try:
+                request = next(state[1])
+                while request is not None and (request[1] == 0 or request[2] == 0):
+                    request = next(state[1])
+            except StopIteration as stop:
+                results[name] = stop.value
+                del active[name]
+                return
+            state[2] = request
+            if request is None:
+                state[3] = time.monotonic() + self.homingSettle
+            else:
+                state[2] = list(request)
+        while len(waiting) != 0 or len(active) != 0:
+            for name in list(waiting):
+                motor_number = waiting[name][0]
+                busy = any(state[0] == motor_number for state in active.values())
+                if not busy and all(dep in results or dep not in phases for dep in interlocks.get(name, [])):
+                    active[name] = [motor_number, waiting.pop(name)[1], None, 0]
+                    advance(name)
+            if len(active) == 0:
+                if len(waiting) != 0:
+                    raise ValueError("stepmotor.py, homing interlocks can never be met: %s" % list(waiting))
+                break
+            moving = [state for state in active.values() if state[2] is not None]
+            if len(moving) == 0:
+                time.sleep(max(0, min(state[3] for state in active.values()) - time.monotonic()))
+            else:
+                # every round lasts as long as the shortest remaining request, so no axis waits on a long train
+                round_time = min(state[2][1] / state[2][2] for state in moving)
+                direction = [0,0,0]
+                pulse_count = [0,0,0]
+                frequency = [0,0,0]
+                for state in moving:
+                    axis = state[0] - 1
+                    direction[axis] = state[2][0]
+                    pulse_count[axis] = min(state[2][1], max(1, math.floor(round_time * state[2][2] + 1e-9)))
+                    frequency[axis] = state[2][2]
+                self.multiMotorRun(direction, pulse_count, frequency, ramp=True)
+                for state in moving:
+                    state[2][1] = state[2][1] - pulse_count[state[0] - 1]
+            now = time.monotonic()
+            for name in list(active):
+                state = active[name]
+                if (state[2] is not None and state[2][1] <= 0) or (state[2] is None and now >= state[3]):
+                    advance(name)
+        return results
+
+    def seekShoulderSensor(self):
+        yield [0, 400, self.homingSeekFrequency]
+        yield from self.seekSensorEdge(2, 1, 1, precise=False)
+
+    def seekElbowSensor(self):
+        yield [1, 270, self.homingSeekFrequency]
+        yield from self.seekSensorEdge(3, 0, 1, precise=False)
+
+    def seekBaseSensor(self):
+        i = 0
+        direction = 1
+        semicyclePluse = 200 * 3 * self.readA4988Msx()
+        while self.readSensor(1) == 0:
+            yield [direction, self.homingChunk, self.homingSeekFrequency]
+            i = i + self.homingChunk
+            if i > semicyclePluse:
+                direction = 0
+        if direction == 0:
+            while self.readSensor(1) == 1:
+                yield [direction, self.homingChunk, self.homingSeekFrequency]
+
+    def homingSeekPhases(self):
+        return {
+            'seek2': (2, self.seekShoulderSensor()),
+            'seek3': (3, self.seekElbowSensor()),
+            'seek1': (1, self.seekBaseSensor()),
+        }
+
+    def caliSensorPointParallel(self):
+        phases = self.homingSeekPhases()
+        phases['mid1'] = (1, self.homeAxisFast(1, 1, 200))
+        phases['mid2'] = (2, self.homeAxisFast(2, 1, 50))
+        phases['mid3'] = (3, self.homeAxisFast(3, 0, 50))
+        results = self.runHomingPhases(phases, self.homingInterlocks)
+        self.lastAngle = self.zeroAngle.copy()
+        return [results['mid1'], results['mid2'], results['mid3']]
+
+    def gotoSensorPointParallel(self, pulse_count):
+        def center(motor_number, approach_dir):
+            yield from self.seekSensorEdge(motor_number, 1 - approach_dir, 0)
+            yield [approach_dir, round(pulse_count[motor_number - 1]), self.homingCreepFrequency]
+        phases = self.homingSeekPhases()
+        phases['mid1'] = (1, center(1, 1))
+        phases['mid2'] = (2, center(2, 1))
+        phases['mid3'] = (3, center(3, 0))
+        self.runHomingPhases(phases, self.homingInterlocks)
+        self.lastAngle = self.zeroAngle.copy()
+
+    #Bring the shoulder and elbow onto their sensors together, then find the base sensor
+    def seekSensorPointFast(self):
+        self.motorRun(2,0,400,self.homingSeekFrequency, ramp=True)
+        self.motorRun(3,1,270,self.homingSeekFrequency, ramp=True)
+        s2 = self.tcrt5000.readTCRT5000S2()
+        s3 = self.tcrt5000.readTCRT5000S3()
+        while s2 == 0 or s3 == 0:
+            chunk = [0, self.homingChunk if s2 == 0 else 0, self.homingChunk if s3 == 0 else 0]
+            self.multiMotorRun([0,1,0], chunk, [0, self.homingSeekFrequency, self.homingSeekFrequency], ramp=True)
+            s2 = self.tcrt5000.readTCRT5000S2()
+            s3 = self.tcrt5000.readTCRT5000S3()
+        i = 0
+        direction = 1
+        semicyclePluse = 200 * 3 * self.readA4988Msx()
+        s1 = self.tcrt5000.readTCRT5000S1()
+        while s1 == 0:
+            i = i + self.homingChunk
+            self.motorRun(1,direction,self.homingChunk,self.homingSeekFrequency, ramp=True)
+            s1 = self.tcrt5000.readTCRT5000S1()
+            if i > semicyclePluse:
+                direction = 0
+        if direction == 0:
+            while s1 == 1:
+                self.motorRun(1,direction,self.homingChunk,self.homingSeekFrequency, ramp=True)
+                s1 = self.tcrt5000.readTCRT5000S1()
+
+    def caliSensorPointFast(self):
+        self.seekSensorPointFast()
+        pulse1 = self.gotoMidSensorPoint1()
+        pulse2 = self.gotoMidSensorPoint2()
+        pulse3 = self.gotoMidSensorPoint3()
+        self.lastAngle = self.zeroAngle.copy()
+        return [pulse1,pulse2,pulse3]
+
     def gotoMidSensorPoint1(self):
+        if self.homingMode != HOMING_SWEEP:
+            return self.runHomingAxis(1, self.homeAxisFast(1, 1, 200))
         self.motorRun(1,0,200,1000)
         direction = 1
         each_pulse_count = 0
@@ -194,6 +527,8 @@ class StepMotor:
         self.motorRun(1, 1, round(half_pulse_count), 1000)
         return (total_pulse_count / 2 / 6)
     def gotoMidSensorPoint2(self):
+        if self.homingMode != HOMING_SWEEP:
+            return self.runHomingAxis(2, self.homeAxisFast(2, 1, 50))
         s2 = self.tcrt5000.readTCRT5000S2()
         while s2 == 1:
             self.motorRun(2,0,1,1000)
@@ -226,6 +561,8 @@ class StepMotor:
         self.motorRun(2, 1, round(half_pulse_count), 1000) 
         return (total_pulse_count / 2 / 6)
     def gotoMidSensorPoint3(self):
+        if self.homingMode != HOMING_SWEEP:
+            return self.runHomingAxis(3, self.homeAxisFast(3, 0, 50))
         s3 = self.tcrt5000.readTCRT5000S3()
         while s3 == 1:
             self.motorRun(3,1,1,1000)
@@ -258,6 +595,10 @@ class StepMotor:
         self.motorRun(3, 0, round(half_pulse_count), 1000)
         return (total_pulse_count / 2 / 6)
     def caliSensorPoint(self):        
+        if self.homingMode == HOMING_FAST:
+            return self.caliSensorPointFast()
+        elif self.homingMode == HOMING_PARALLEL:
+            return self.caliSensorPointParallel()
         self.motorRun(2,0,400,1000)
         self.motorRun(3,1,270,1000) 
         s2 = self.tcrt5000.readTCRT5000S2()                    
@@ -294,7 +635,33 @@ class StepMotor:
         #print("stepmotor.py,", pulse)
         self.lastAngle = self.zeroAngle.copy()
         return pulse
+    #Return to the sensor centers found by a previous calibration without sweeping
+    def gotoSensorPointFast(self, pulse_count):
+        self.seekSensorPointFast()
+        for motor_number, approach_dir in ((1, 1), (2, 1), (3, 0)):
+            self.runHomingAxis(motor_number, self.seekSensorEdge(motor_number, 1 - approach_dir, 0))
+            self.motorRun(motor_number, approach_dir, round(pulse_count[motor_number - 1]), self.homingCreepFrequency)
+        self.lastAngle = self.zeroAngle.copy()
+
+    #Check a stored calibration: from each sensor center the far edge must lie about half a width away.
+    #Only the fast homing modes seek at homingSeekFrequency; sweep mode verifies at the creep frequency
+    def verifySensorPoint(self, pulse_count):
+        valid = True
+        frequency = self.homingSeekFrequency if self.homingMode != HOMING_SWEEP else self.homingCreepFrequency
+        for motor_number, approach_dir in ((1, 1), (2, 1), (3, 0)):
+            if self.readSensor(motor_number) != 1:
+                return False
+            distance = self.runHomingAxis(motor_number, self.seekSensorEdge(motor_number, approach_dir, 0, frequency=frequency))
+            self.motorRun(motor_number, 1 - approach_dir, distance, self.homingCreepFrequency)
+            if math.fabs(distance - pulse_count[motor_number - 1]) > self.homingTolerance + 2:
+                valid = False
+        return valid
+
     def gotoSensorPoint(self, pulse_count):   
+        if self.homingMode == HOMING_FAST:
+            return self.gotoSensorPointFast(pulse_count)
+        elif self.homingMode == HOMING_PARALLEL:
+            return self.gotoSensorPointParallel(pulse_count)
         self.motorRun(2,0,400,1000)          
         self.motorRun(3,1,270,1000)         
         s2 = self.tcrt5000.readTCRT5000S2()                     
@@ -344,37 +711,212 @@ class StepMotor:
         self.motorRun(3, 0, round(half_pulse_count), 1000) 
         self.lastAngle = self.zeroAngle.copy()
 
+    #Convert a target angle to whole pulses from the integer ledger, so rounding never accumulates
+    def planStepMotorToTargetAngle(self, targetAngle):
+        return self.planToPosition([self.angleToPosition(targetAngle[i], i) for i in range(3)])
+
+    #Whole pulses of the current MSx mode from the planned ledger to a ledger position
+    def planToPosition(self, position):
+        units = self.microstepsPerPulse()
+        direction = [0,0,0]
+        pulse_int_value = [0,0,0]
+        for i in range(3):
+            delta = position[i] - self.plannedPosition[i]
+            pulses = round(delta / units)
+            direction[i] = 1 if pulses > 0 else 0
+            pulse_int_value[i] = abs(pulses)
+            self.plannedPosition[i] = self.plannedPosition[i] + pulses * units
+        return direction, pulse_int_value
+
+    #Start time (us) of every lead pulse of a path, plus its end time. frequency_scale is how many
+    #pulses of the configured mode one pulse of the current mode replaces
+    def leadStepTimes(self, lead_count, frequency_scale=1):
+        frequency = min(f for f in self.A4988ClkFrequency if f != 0) / frequency_scale
+        if self.profileMode == motionProfile.PROFILE_CONSTANT:
+            intervals = self.pulseEngine.constantIntervals(lead_count, frequency)
+        else:
+            max_velocity = round(self.angleToPulseCount(min(self.maxVelocity)))
+            acceleration = round(self.angleToPulseCount(min(self.maxAcceleration)))
+            intervals = motionProfile.stepIntervals(lead_count, frequency, max_velocity, acceleration, self.profileMode)
+        step_times = [0.0]
+        for interval in intervals:
+            step_times.append(step_times[-1] + interval)
+        return step_times
+
+    #Select the coarsest MSx mode (1 full step .. 4 eighth step) long paths may switch to
+    def setMicrostepSwitching(self, enable, coarsest_mode=1):
+        self.microstepSwitching = enable
+        self.coarsestMsxMode = coarsest_mode
+
+    #Ledger position of the nearest step of a mode units microsteps wide. The translator only holds
+    #coarse steps at phases a multiple of units away from its home state; direction 1 rounds up, -1 down
+    def gridPosition(self, position, index, units, direction=0):
+        phase = position - self.phaseOrigin[index]
+        if direction > 0:
+            steps = -(-phase // units)
+        elif direction < 0:
+            steps = phase // units
+        else:
+            steps = round(phase / units)
+        return self.phaseOrigin[index] + steps * units
+
+    #Coarsest MSx mode in which the longest joint travel of a path still takes microstepMinPulses
+    def pathMsxMode(self, positions):
+        travel = [0,0,0]
+        previous = list(self.plannedPosition)
+        for position in positions:
+            for i in range(3):
+                travel[i] = travel[i] + math.fabs(position[i] - previous[i])
+            previous = position
+        for mode in range(self.coarsestMsxMode, self.A4988MsxModeValue):
+            units = MICROSTEP_RESOLUTION >> (mode - 1)
+            if max(travel) >= units * self.microstepMinPulses:
+                return mode, travel
+        return self.A4988MsxModeValue, travel
+
+    #Run a list of target angles as one continuous pulse stream
+    def runSegments(self, targetAngles):
+        if self.microstepSwitching:
+            positions = [[self.angleToPosition(targetAngle[i], i) for i in range(3)] for targetAngle in targetAngles]
+            mode, travel = self.pathMsxMode(positions)
+            if mode != self.A4988MsxModeValue:
+                self.runSegmentsInMode(positions, mode, travel)
+                return
+        self.runPlan([self.planStepMotorToTargetAngle(targetAngle) for targetAngle in targetAngles])
+
+    #Run a path in a coarser MSx mode: the fine mode first steps every moving axis onto the coarse
+    #grid, the path runs on grid positions, then the fine mode finishes the last part of a coarse step.
+    #Axes travelling less than two coarse steps only move in the finishing run.
+    def runSegmentsInMode(self, positions, mode, travel):
+        fine_mode = self.A4988MsxModeValue
+        fine_units = self.microstepsPerPulse()
+        units = MICROSTEP_RESOLUTION >> (mode - 1)
+        moving = [travel[i] >= 2 * units for i in range(3)]
+        first = [0,0,0]
+        last = [0,0,0]
+        for position in positions:
+            for i in range(3):
+                if first[i] == 0 and position[i] != self.plannedPosition[i]:
+                    first[i] = 1 if position[i] > self.plannedPosition[i] else -1
+        for i in range(3):
+            previous = positions[-2][i] if len(positions) > 1 else self.plannedPosition[i]
+            last[i] = 1 if positions[-1][i] > previous else -1
+        previous = list(self.plannedPosition)
+        start = [self.gridPosition(previous[i], i, units, first[i]) if moving[i] else previous[i] for i in range(3)]
+        self.runPlan([self.planToPosition(start)])
+        plan = []
+        for k in range(len(positions)):
+            grid = list(plan[-1]) if len(plan) != 0 else list(start)
+            for i in range(3):
+                if not moving[i] or positions[k][i] == previous[i]:
+                    continue
+                if k == len(positions) - 1:
+                    grid[i] = self.gridPosition(positions[k][i], i, units, -last[i])
+                else:
+                    grid[i] = self.gridPosition(positions[k][i], i, units)
+            previous = positions[k]
+            plan.append(grid)
+        self.setA4988MsxMode(mode)
+        try:
+            self.runPlan([self.planToPosition(grid) for grid in plan], units / fine_units)
+        finally:
+            self.setA4988MsxMode(fine_mode)
+        self.runPlan([self.planToPosition(positions[-1])])
+
+    #Run planned (direction, pulse count) segments as one continuous pulse stream
+    def runPlan(self, plan, frequency_scale=1):
+        segments = []
+        first_direction = [0,0,0]
+        moving = [0,0,0]
+        for direction, pulse_int_value in plan:
+            if max(pulse_int_value) <= 0:
+                continue
+            for i in range(3):
+                if pulse_int_value[i] != 0 and moving[i] == 0:
+                    first_direction[i] = direction[i]
+                    moving[i] = 1
+            segments.append(([self.motorDirection(d) for d in direction], pulse_int_value))
+        if len(segments) == 0:
+            return
+        direction_level = [self.motorDirection(d) for d in first_direction]
+        step_times = self.leadStepTimes(sum(max(segment[1]) for segment in segments), frequency_scale)
+        schedule = self.pulseEngine.buildPathSchedule(segments, step_times, direction_level)
+        self.sendSchedule(first_direction, moving, schedule)
+
+    #Set the DIR pins and run one compiled pulse stream, keeping it when a move is being compiled
+    def sendSchedule(self, direction, moving, schedule):
+        self.setMotorDirection(direction, moving)
+        if self.recording is not None:
+            self.recording.append((self.A4988MsxModeValue, list(direction), list(moving), schedule))
+        self.pulseEngine.runSchedule(schedule)
+
     def moveStepMotorToTargetAngle(self, targetAngle):
-        direction, pulse_count = self.angleToStepMotorParameter(targetAngle)                          
-        self.lastAngle = targetAngle.copy()
-        pulse_int_value = [0,0,0]                                                                   
-        for i in range(3):                                                                          
-            if direction[i] == self.pulse_margin_dir[i]:                                       
-                pulse_int_value[i] = round(pulse_count[i] + self.pulse_margin[i])                  
-                self.pulse_margin[i] = pulse_count[i] + self.pulse_margin[i] - pulse_int_value[i]    
-            else:                                                                                    
-                pulse_int_value[i] = round(pulse_count[i] - (self.pulse_margin[i]))                   
-                self.pulse_margin[i] = pulse_count[i] - self.pulse_margin[i] - pulse_int_value[i]    
-        #print("Stepmotor.py, ", pulse_count, pulse_int_value, direction, self.pulse_margin_dir, self.pulse_margin)
-        self.pulse_margin_dir = direction.copy()                                                                                                                                                      
-        buflist = pulse_count.copy()  
-        buflist.sort(reverse=True)
-        maxdata = buflist[0]
-        
-        if maxdata != 0:
-            motor1 = threading.Thread(target=self.motorRun, args=(1, direction[0], pulse_int_value[0], self.A4988ClkFrequency[0],))
-            motor2 = threading.Thread(target=self.motorRun, args=(2, direction[1], pulse_int_value[1], self.A4988ClkFrequency[1],))
-            motor3 = threading.Thread(target=self.motorRun, args=(3, direction[2], pulse_int_value[2], self.A4988ClkFrequency[2],))
-            motor1.start()
-            motor2.start()
-            motor3.start()
-            try:
-                motor1.join()
-                motor2.join()
-                motor3.join()
-            except:
-                #print("Stepmotor.py, Motor thread is False.")
-                pass
+        self.runSegments([targetAngle])
+
+    #Pulse periods of a joint-space move: every axis runs its own ramp at its own maximum velocity and
+    #acceleration (trapezoidal when the profile mode is constant), so the axes are not synchronized
+    def rapidIntervals(self, pulse_count):
+        mode = self.profileMode if self.profileMode != motionProfile.PROFILE_CONSTANT else motionProfile.PROFILE_TRAPEZOIDAL
+        intervals = []
+        for i in range(3):
+            frequency = self.A4988ClkFrequency[i]
+            if pulse_count[i] == 0 or frequency == 0:
+                intervals.append(())
+                continue
+            max_velocity = round(self.angleToPulseCount(self.maxVelocity[i]))
+            acceleration = round(self.angleToPulseCount(self.maxAcceleration[i]))
+            intervals.append(motionProfile.stepIntervals(pulse_count[i], frequency, max_velocity, acceleration, mode))
+        return intervals
+
+    #Point-to-point move in joint space; returns the estimated and the measured duration in seconds
+    def rapidMoveToTargetAngle(self, targetAngle):
+        direction, pulse_count = self.planStepMotorToTargetAngle(targetAngle)
+        intervals = self.rapidIntervals(pulse_count)
+        estimated = max(sum(axis_intervals) for axis_intervals in intervals) / 1000000
+        schedule = self.pulseEngine.buildSchedule(intervals)
+        start = time.perf_counter()
+        if schedule:
+            self.sendSchedule(direction, pulse_count, schedule)
+        self.rapidReport = {"estimated": estimated, "actual": time.perf_counter() - start, "pulse_count": pulse_count}
+        return self.rapidReport
+
+    #Run a move (rapid: a single target angle run by rapidMoveToTargetAngle) and return it compiled:
+    #the ledger position it starts and ends at and every pulse stream sent, for replayTrajectory
+    def compileMove(self, targetAngles, rapid=False):
+        start = list(self.plannedPosition)
+        msx_mode = self.A4988MsxModeValue
+        self.recording = []
+        try:
+            if rapid:
+                self.rapidMoveToTargetAngle(targetAngles[0])
+            else:
+                self.runSegments(targetAngles)
+            steps = self.recording
+        finally:
+            self.recording = None
+        return {"start": start, "end": list(self.plannedPosition), "msx_mode": msx_mode, "targets": targetAngles,
+                "rapid": dict(self.rapidReport) if rapid else None, "steps": steps}
+
+    #Send the pulse streams of a compiled move again without any planning. Returns False and sends
+    #nothing when the ledger is not where the move was compiled from
+    def replayTrajectory(self, entry):
+        if entry["start"] != list(self.plannedPosition) or entry["msx_mode"] != self.A4988MsxModeValue:
+            return False
+        start = time.perf_counter()
+        try:
+            for mode, direction, moving, schedule in entry["steps"]:
+                if mode != self.A4988MsxModeValue:
+                    self.setA4988MsxMode(mode)
+                self.sendSchedule(direction, moving, schedule.tolist())
+        finally:
+            if self.A4988MsxModeValue != entry["msx_mode"]:
+                self.setA4988MsxMode(entry["msx_mode"])
+        for i in range(3):
+            self.plannedPosition[i] = entry["end"][i]
+        if entry["rapid"] is not None:
+            self.rapidReport = {"estimated": entry["rapid"]["estimated"], "actual": time.perf_counter() - start,
+                                "pulse_count": entry["rapid"]["pulse_count"]}
+        return True
 
 if __name__ == '__main__':
     import sys
@@ -385,40 +927,17 @@ if __name__ == '__main__':
         if len(sys.argv)!=3:
             while True:
                 print("The stepper motor turns in one direction.")
-                motor1 = threading.Thread(target=motor.motorRun, args=(1,0,200,1000,))
-                motor2 = threading.Thread(target=motor.motorRun, args=(2,0,200,1000,))
-                motor3 = threading.Thread(target=motor.motorRun, args=(3,0,200,1000,))
-                motor1.start()
-                motor2.start()
-                motor3.start()
-                motor1.join()
-                motor2.join()
-                motor3.join()
+                motor.multiMotorRun([0,0,0], [200,200,200], [1000,1000,1000])
                 print("The stepper motor turns in the other direction.")
-                motor1 = threading.Thread(target=motor.motorRun, args=(1,1,200,1000,))
-                motor2 = threading.Thread(target=motor.motorRun, args=(2,1,200,1000,))
-                motor3 = threading.Thread(target=motor.motorRun, args=(3,1,200,1000,))
-                motor1.start()
-                motor2.start()
-                motor3.start()
-                motor1.join()
-                motor2.join()
-                motor3.join()
+                motor.multiMotorRun([1,1,1], [200,200,200], [1000,1000,1000])
         elif len(sys.argv)==3:
             motor_number = int(sys.argv[1])
             direction = int(sys.argv[2])
             while True:
                 print("The stepper motor turns in one direction:" , direction)
-                motor_threading = threading.Thread(target=motor.motorRun, args=(motor_number,direction,3200,1000,))
-                motor_threading.start()
-                motor_threading.join()
+                motor.motorRun(motor_number, direction, 3200, 1000)
     except KeyboardInterrupt:  # When 'Ctrl+C' is pressed, the child program destroy() will be  executed.
-        if len(sys.argv)!=3:
-            messageThread.stop_thread(motor1)
-            messageThread.stop_thread(motor2)
-            messageThread.stop_thread(motor3)
-        elif len(sys.argv)==3:
-            messageThread.stop_thread(motor_threading)
+        pass
     finally:
         motor.setA4988Enable(1)
         motor.stopA4988()
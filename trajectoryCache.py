@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+
+import collections
+import json
+import os
+import threading
+import numpy as np
+
+TRAJECTORY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "trajectory_cache")
+
+#Least recently used store of compiled moves (StepMotor.compileMove) whose pulse streams together stay
+#under max_bytes. With a directory every move is also saved as .npz and read back after a restart.
+#Moves are shared between the caller queueing them and the motion executor thread, hence the lock.
+class TrajectoryCache:
+    def __init__(self, max_bytes=16 * 1024 * 1024, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory                               # None keeps the moves in memory only
+        self.entries = collections.OrderedDict()                 # key -> compiled move, oldest first
+        self.size = 0                                            # bytes held by the pulse streams in memory
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if directory is not None:
+            try:
+                os.makedirs(directory, exist_ok=True)
+            except OSError as e:
+                print("trajectoryCache.py, moves kept in memory only:", e)
+                self.directory = None
+
+    def entryPath(self, key):
+        return os.path.join(self.directory, "trajectory_%s.npz" % key)
+
+    def entrySize(self, entry):
+        return sum(schedule.nbytes for mode, direction, moving, schedule in entry["steps"]) + 24 * 3 * len(entry["targets"])
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits = self.hits + 1
+                return entry
+        entry = self.loadEntry(key) if self.directory is not None else None
+        with self.lock:
+            if entry is None:
+                self.misses = self.misses + 1
+                return None
+            self.hits = self.hits + 1
+            self.store(key, entry)
+        return entry
+
+    #Keep a freshly compiled move; its schedules are packed into (ticks, 3) arrays
+    def put(self, key, entry):
+        entry = dict(entry)
+        entry["steps"] = [(mode, direction, moving, np.array(schedule, dtype=np.int64).reshape(-1, 3))
+                          for mode, direction, moving, schedule in entry["steps"]]
+        with self.lock:
+            self.store(key, entry)
+        if self.directory is not None:
+            try:
+                self.saveEntry(key, entry)
+            except OSError as e:
+                print("trajectoryCache.py, move not saved:", e)
+        return entry
+
+    def store(self, key, entry):
+        if key in self.entries:
+            self.size = self.size - self.entrySize(self.entries.pop(key))
+        size = self.entrySize(entry)
+        if size > self.max_bytes:
+            return
+        while self.size + size > self.max_bytes:
+            oldest_key, oldest = self.entries.popitem(last=False)
+            self.size = self.size - self.entrySize(oldest)
+        self.entries[key] = entry
+        self.size = self.size + size
+
+    def saveEntry(self, key, entry):
+        meta = {k: entry[k] for k in ("start", "end", "msx_mode", "targets", "rapid")}
+        meta["steps"] = [[mode, direction, moving] for mode, direction, moving, schedule in entry["steps"]]
+        arrays = {"step%d" % i: step[3] for i, step in enumerate(entry["steps"])}
+        path = self.entryPath(key)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(temp_path, path)
+
+    def loadEntry(self, key):
+        try:
+            with np.load(self.entryPath(key)) as data:
+                entry = json.loads(str(data["meta"]))
+                entry["steps"] = [(mode, direction, moving, data["step%d" % i])
+                                  for i, (mode, direction, moving) in enumerate(entry["steps"])]
+        except (OSError, ValueError, KeyError):
+            return None
+        return entry
+
+    #Forget every move, in memory and on disk
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.startswith("trajectory_") and name.endswith(".npz"):
+                    os.remove(os.path.join(self.directory, name))
+
+    def report(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.size, "hits": self.hits, "misses": self.misses}
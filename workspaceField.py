@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+
+import hashlib
+import json
+import os
+import numpy as np
+
+FIELD_DIR = os.path.dirname(os.path.abspath(__file__))
+WORKSPACE = [[-110, 110], [60, 250], [20, 320]]                  # gamepad X_LIMITS, Y_LIMITS, Z_LIMITS (mm)
+CELL_BLOCKED = 0                                                 # every corner of the cell breaks a constraint
+CELL_FREE = 1                                                    # every corner is reachable within the joint limits
+CELL_MIXED = 2                                                   # checked exactly
+
+#Voxel field of the points the pen may go to: reachable, inside arm_limit_angle1/2/3 and outside the base
+#exclusion sphere. Cells are classified once per geometry from their corners and saved as .npy; points in
+#mixed cells or outside the field are checked exactly, so a lookup agrees with Arm.pointsInWorkspace.
+class WorkspaceField:
+    def __init__(self, arm, workspace=WORKSPACE, resolution=2.0, directory=FIELD_DIR):
+        self.arm = arm
+        self.workspace = workspace
+        self.resolution = resolution
+        self.directory = directory
+        self.key = None
+        self.cells = None
+
+    def geometryKey(self):
+        arm = self.arm
+        geometry = [arm.CLAMP_LENGTH, arm.ORIGINAL_HEIGHT, arm.GROUND_HEIGHT, arm.PEN_HEIGHT, arm.L1_LENGTH,
+                    arm.L2_LENGTH, arm.arm_limit_angle1, arm.arm_limit_angle2, arm.arm_limit_angle3,
+                    arm.offsetAngle, arm.base_radius, self.workspace, self.resolution]
+        return hashlib.sha1(json.dumps(geometry).encode()).hexdigest()[:16]
+
+    def fieldPath(self, key):
+        return os.path.join(self.directory, "workspace_field_%s.npy" % key)
+
+    def build(self):
+        samples = []
+        for low, high in self.workspace:
+            count = int(np.ceil((high - low) / self.resolution)) + 1
+            samples.append(low + np.arange(count) * self.resolution)
+        shape = [len(s) for s in samples]
+        points = np.stack(np.meshgrid(samples[0], samples[1], samples[2], indexing='ij'), axis=-1).reshape(-1, 3)
+        free = self.arm.pointsInWorkspace(points).reshape(shape)
+        corners = 0
+        for dx in (0, 1):
+            for dy in (0, 1):
+                for dz in (0, 1):
+                    corners = corners + free[dx:shape[0]-1+dx, dy:shape[1]-1+dy, dz:shape[2]-1+dz]
+        cells = np.full(corners.shape, CELL_MIXED, dtype=np.uint8)
+        cells[corners == 0] = CELL_BLOCKED
+        cells[corners == 8] = CELL_FREE
+        return cells
+
+    def load(self):
+        key = self.geometryKey()
+        if key == self.key:
+            return
+        path = self.fieldPath(key)
+        try:
+            self.cells = np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            self.cells = self.build()
+            try:
+                temp_path = path + ".tmp"
+                with open(temp_path, "wb") as f:
+                    np.save(f, self.cells)
+                os.replace(temp_path, path)
+            except OSError as e:
+                print("workspaceField.py, field kept in memory only:", e)
+        self.key = key
+
+    #Free flag of every point of an (N,3) array
+    def lookup(self, axis):
+        axis = np.asarray(axis, dtype=float).reshape(-1, 3)
+        self.load()
+        origin = np.array([w[0] for w in self.workspace], dtype=float)
+        index = np.floor((axis - origin) / self.resolution).astype(np.intp)
+        inside = np.all((index >= 0) & (index < np.array(self.cells.shape)), axis=1)
+        state = np.full(len(axis), CELL_MIXED, dtype=np.uint8)
+        state[inside] = self.cells[index[inside,0], index[inside,1], index[inside,2]]
+        free = state == CELL_FREE
+        check = state == CELL_MIXED
+        if check.any():
+            free[check] = self.arm.pointsInWorkspace(axis[check])
+        return free
+
+    #Check a whole interpolated path before it is sent. Returns (True, None, None) when every point is
+    #free, else (False, index of the first blocked point, furthest free point along the path before it)
+    def validatePath(self, points, iterations=12):
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        free = self.lookup(points)
+        if free.all():
+            return True, None, None
+        first = int(np.argmin(free))
+        if first == 0:
+            return False, 0, None
+        good = points[first - 1]
+        bad = points[first]
+        for i in range(iterations):                              # bisect the crossing between the two samples
+            middle = (good + bad) / 2
+            if self.arm.pointsInWorkspace(middle)[0]:
+                good = middle
+            else:
+                bad = middle
+        return False, first, good.tolist()